@@ -1,6 +1,44 @@
 import struct
 import json
+import math
 import time
+import sys
+import os
+import tempfile
+
+from file_watch import FileWatcher, TailReader
+from reading_store import ReadingStore, READINGS_DB
+from log_rotation import LogRotation, iter_lines
+from json_codec import dumps, dumps_line, decode_raw, SEPARATORS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# dtype -> (struct code, size in bytes), all fields are big-endian
+DTYPE_FORMATS = {
+    'float': ('f', 4),
+    'long':  ('l', 4),
+    'int':   ('h', 2)
+}
+
+NUMPY_DTYPES = {
+    'float': '>u4',   # raw bits, rounded exactly like decode_frame()
+    'long':  '>i4',
+    'int':   '>i2'
+}
+
+FLOAT32 = struct.Struct('>f')
+ROUND_CACHE_SIZE = 65536
+STATE_FILE = 'device_state.json'
+BATCH_SIZE = 500  # raw records decoded between checkpoints
+IDLE_RECHECK = 30  # seconds between rotation checks while no data arrives
+BULK_CHUNK_SIZE = 64 * 1024 * 1024  # bytes of raw records decoded per NumPy batch
+NUMPY_MIN_FRAMES = 256  # decode_many() lists at least this long are decoded column-wise with NumPy
+READINGS_BACKEND = os.environ.get('READINGS_BACKEND', 'jsonl')  # 'sqlite' also inserts into READINGS_DB
+LIVE_OUTPUT = 'decord_result.jsonl'       # tailed by mqtty.py and app.py
+BULK_OUTPUT = 'decord_backfill.jsonl'     # default target of the bulk command
 
 class FlowMeterAccurateDecoder:
     def __init__(self):
@@ -28,72 +66,525 @@ class FlowMeterAccurateDecoder:
             (0x2A, 'float', 'flow_record_2'),
             (0x30, 'float', 'flow_record_5')
         ]
+        self.compile_mapping()
 
-    def decode_packet(self, data_hex):
+    def compile_mapping(self):
+        # Whole data field as one struct: pad bytes between the mapped registers.
+        # Float registers are unpacked as raw 32-bit words and rounded through a
+        # cache, round() costs more than the unpack itself and readings repeat a lot.
+        fmt = '>'
+        pos = 0
+        self.round_cache = {}
+        self.field_names = []
+        self.float_indexes = []
+        self.fields = []          # (name, Struct, offset, is_float) for short data fields
+        self.unknown_fields = []  # unknown dtypes always decode as 0
+        self.numpy_fields = []    # (name, big-endian dtype, offset)
+
+        for addr, dtype, name in sorted(self.mapping):
+            if dtype not in DTYPE_FORMATS:
+                self.unknown_fields.append(name)
+                continue
+
+            code, size = DTYPE_FORMATS[dtype]
+            offset = addr * 2
+            if offset < pos:
+                raise ValueError(f"Mapping field {name} overlaps the previous field")
+            if offset > pos:
+                fmt += f'{offset - pos}x'
+            fmt += 'I' if dtype == 'float' else code
+            pos = offset + size
+
+            if dtype == 'float':
+                self.float_indexes.append(len(self.field_names))
+            self.field_names.append(name)
+            self.fields.append((name, struct.Struct('>' + code), offset, dtype == 'float'))
+            self.numpy_fields.append((name, NUMPY_DTYPES[dtype], offset))
+
+        self.record_struct = struct.Struct(fmt)
+        # copying a pre-sized dict is cheaper than growing a new one per packet
+        self.record_template = dict.fromkeys(self.field_names)
+
+        # bulk mode writes decoded lines from a %-template in decode_frame() key order,
+        # spaced like the JSON backend writes them so both modes give the same bytes
+        comma, colon = SEPARATORS
+        measurements = comma.join(
+            [f'{dumps(name)}{colon}%s' for name in self.field_names] +
+            [f'{dumps(name)}{colon}0' for name in self.unknown_fields]
+        )
+        self.line_template = (
+            f'{{"timestamp"{colon}%s{comma}"imei"{colon}%s{comma}"decoded_measurements"{colon}{{'
+            + measurements + '}}\n'
+        )
+
+    def data_field_bounds(self, raw_bytes):
+        # Protocol structure: NB[Header],[IMEI],[DATA],END
+        imei_comma = raw_bytes.find(b',')
+        if imei_comma < 0:
+            return None
+        data_comma = raw_bytes.find(b',', imei_comma + 1)
+        if data_comma < 0:
+            return None
+
+        start = data_comma + 1
+        if raw_bytes.endswith(b',END'):
+            end = len(raw_bytes) - 4
+        else:
+            end = raw_bytes.find(b',', start)
+            if end < 0:
+                end = len(raw_bytes)
+        return start, end
+
+    def decode_frame(self, raw_bytes):
         try:
-            # Protocol structure: NB[Header],[IMEI],[DATA],END
-            raw_bytes = bytes.fromhex(data_hex)
-            segments = raw_bytes.split(b',')
-            
-            if len(segments) < 3:
+            bounds = self.data_field_bounds(raw_bytes)
+            if bounds is None:
                 return None
-            
-            data_field = segments[2]
-            results = {}
-
-            for addr, dtype, name in self.mapping:
-                offset = addr * 2
-                
-                if dtype == 'float':
-                    chunk = data_field[offset:offset+4]
-                    if len(chunk) == 4:
-                        results[name] = round(struct.unpack('>f', chunk)[0], 4)
-                elif dtype == 'long':
-                    chunk = data_field[offset:offset+4]
-                    if len(chunk) == 4:
-                        results[name] = struct.unpack('>l', chunk)[0]
-                elif dtype == 'int':
-                    chunk = data_field[offset:offset+2]
-                    if len(chunk) == 2:
-                        results[name] = struct.unpack('>h', chunk)[0]
-                else:
-                    results[name] = 0
+            start, end = bounds
+
+            if end - start >= self.record_struct.size:
+                values = list(self.record_struct.unpack_from(raw_bytes, start))
+                round_cache = self.round_cache
+                for i in self.float_indexes:
+                    bits = values[i]
+                    value = round_cache.get(bits)
+                    if value is None:
+                        value = self.round_float(bits)
+                    values[i] = value
+                results = self.record_template.copy()
+                results.update(zip(self.field_names, values))
+            else:
+                # truncated data field: decode only the registers that fit
+                results = {}
+                for name, field_struct, offset, is_float in self.fields:
+                    if offset + field_struct.size <= end - start:
+                        value = field_struct.unpack_from(raw_bytes, start + offset)[0]
+                        results[name] = self.finite(value) if is_float else value
+
+            for name in self.unknown_fields:
+                results[name] = 0
             return results
         except Exception:
             return None
 
-    def monitor_and_save(self, input_file, output_file):
-        print(f"Monitoring {input_file}... Saving to {output_file}")
-        
-        # Open output file in append mode ('a')
-        with open(input_file, 'r') as f_in, open(output_file, 'a') as f_out:
-            while True:
-                line = f_in.readline()
-                if not line:
-                    time.sleep(0.5)
+    @staticmethod
+    def finite(value):
+        # NaN / Infinity registers are stored as None (JSON null) whatever the JSON backend
+        return round(value, 4) if math.isfinite(value) else None
+
+    def round_float(self, bits):
+        value = self.finite(FLOAT32.unpack(bits.to_bytes(4, 'big'))[0])
+        if len(self.round_cache) >= ROUND_CACHE_SIZE:
+            self.round_cache.clear()
+        self.round_cache[bits] = value
+        return value
+
+    def decode_packet(self, data_hex):
+        try:
+            raw_bytes = bytes.fromhex(data_hex)
+        except (TypeError, ValueError):
+            return None
+        return self.decode_frame(raw_bytes)
+
+    def decode_many(self, frames, columns=False):
+        """Decode a list of frames (raw bytes or hex strings) in one call.
+
+        Returns decode_frame()'s result per frame, or with columns=True a
+        dict field name -> list of values (None where a frame did not
+        decode), which skips building a dict per frame. With NumPy, lists of
+        NUMPY_MIN_FRAMES or more are decoded column-wise: the data fields of
+        all frames are located in one pass over the joined bytes and read
+        through the numpy_fields dtype, only frames with a short data field
+        go through decode_frame(). The values are the same either way.
+        """
+        if np is None or len(frames) < NUMPY_MIN_FRAMES:
+            results = []
+            for frame in frames:
+                if isinstance(frame, str):
+                    try:
+                        frame = bytes.fromhex(frame)
+                    except ValueError:
+                        results.append(None)
+                        continue
+                results.append(self.decode_frame(frame))
+            rows, table = [], None
+        else:
+            rows, table, rest = self.decode_frames_numpy(frames)
+            results = [None] * len(frames)
+            for i, decoded in rest.items():
+                results[i] = decoded
+
+        if not columns:
+            if rows:
+                names = self.field_names
+                unknown = dict.fromkeys(self.unknown_fields, 0)
+                for i, row in zip(rows, zip(*self.numpy_columns(table))):
+                    decoded = dict(zip(names, row))
+                    decoded.update(unknown)
+                    results[i] = decoded
+            return results
+
+        # columns: the NumPy registers scattered into place, the other frames filled from their dicts
+        values = self.numpy_columns(table, arrays=True) if rows else []
+        decoded_rest = [(i, decoded) for i, decoded in enumerate(results) if decoded is not None]
+        out = {}
+        for n, name in enumerate(self.field_names + self.unknown_fields):
+            if len(rows) == len(frames):
+                out[name] = values[n].tolist() if n < len(values) else [0] * len(frames)
+                continue
+            column = np.full(len(frames), None, dtype=object)
+            if rows:
+                column[rows] = values[n] if n < len(values) else 0
+            for i, decoded in decoded_rest:
+                column[i] = decoded.get(name)
+            out[name] = column.tolist()
+        return out
+
+    def decode_frames_numpy(self, frames):
+        """(rows, table, rest) of a list of frames, the NumPy path of decode_many().
+
+        rows are the positions of the frames with a full-size data field,
+        table their registers (numpy_dtype(), see numpy_columns()) and rest
+        maps every other frame that parses as hex to decode_frame()'s result.
+        """
+        data, lengths = self.join_frames(frames)
+        rows, others, table = self.locate_data_fields(data, lengths)
+        rest = {i: self.decode_frame(data[start:end]) for i, start, end in others}
+        return rows, table, rest
+
+    @staticmethod
+    def join_frames(frames):
+        """(all frames as one bytes, byte length per frame), -1 for a hex string that does not parse."""
+        if set(map(type, frames)) == {str}:
+            # one fromhex() for the lot, unless a frame is malformed (odd length, whitespace, ...)
+            lengths = np.fromiter(map(len, frames), dtype=np.int64, count=len(frames))
+            if not (lengths % 2).any():
+                try:
+                    data = bytes.fromhex("".join(frames))
+                except ValueError:
+                    data = None
+                if data is not None and 2 * len(data) == lengths.sum():
+                    return data, lengths // 2
+
+        parts = []
+        lengths = []
+        for frame in frames:
+            if isinstance(frame, str):
+                try:
+                    frame = bytes.fromhex(frame)
+                except ValueError:
+                    lengths.append(-1)
                     continue
-                
+            parts.append(frame)
+            lengths.append(len(frame))
+        return b"".join(parts), lengths
+
+    def locate_data_fields(self, data, lengths):
+        """Data fields of join_frames() output, found for all frames at once.
+
+        Same bounds as data_field_bounds(): after the second comma, up to
+        ",END" or the next comma. Returns (positions of the frames with a
+        full-size data field, (position, start, end) of the other parsed
+        frames, numpy_dtype() table of the full ones).
+        """
+        size = self.record_struct.size
+        lengths = np.asarray(lengths, dtype=np.int64)
+        parsed = lengths >= 0
+        lengths = np.maximum(lengths, 0)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        buf = np.frombuffer(data, dtype=np.uint8)
+
+        # padded past the end of the buffer so "no further comma" fails every bound check
+        commas = np.flatnonzero(buf == ord(','))
+        commas = np.concatenate([commas, np.full(3, len(buf) + 1, dtype=commas.dtype)])
+        k = np.searchsorted(commas, starts)
+        second = commas[k + 1]
+        data_start = second + 1
+
+        has_end = lengths >= 4
+        tail = np.maximum(ends - 4, 0)
+        if len(buf):
+            for j, char in enumerate(b',END'):
+                has_end &= buf[np.minimum(tail + j, len(buf) - 1)] == char
+        third = commas[k + 2]
+        data_end = np.where(has_end, ends - 4, np.where(third < ends, third, ends))
+
+        ok = parsed & (lengths > 0) & (commas[k] < ends) & (second < ends) & (data_end - data_start >= size)
+        rows = np.flatnonzero(ok)
+        other = np.flatnonzero(parsed & ~ok)
+        rest = list(zip(other.tolist(), starts[other].tolist(), ends[other].tolist()))
+        if not len(rows):
+            return [], rest, None
+
+        fields = np.lib.stride_tricks.sliding_window_view(buf, size)[data_start[rows]]
+        table = np.ascontiguousarray(fields).view(self.numpy_dtype()).ravel()
+        return rows.tolist(), rest, table
+
+    def numpy_dtype(self):
+        return np.dtype({
+            'names': [f[0] for f in self.numpy_fields],
+            'formats': [f[1] for f in self.numpy_fields],
+            'offsets': [f[2] for f in self.numpy_fields],
+            'itemsize': self.record_struct.size
+        })
+
+    def numpy_columns(self, table, render=None, arrays=False):
+        """One list per register (field_names order) of a numpy_dtype() table.
+
+        Values are the ones decode_frame() gives, passed through render
+        (e.g. dumps) when it is set. arrays=True returns object arrays
+        instead of lists.
+        """
+        # every column is converted once per distinct value, readings repeat a lot
+        columns = []
+        float_names = {self.field_names[i] for i in self.float_indexes}
+        for name, _, _ in self.numpy_fields:
+            uniq, inverse = np.unique(table[name], return_inverse=True)
+            if name in float_names:
+                values = [self.round_float(u) for u in uniq.tolist()]
+            else:
+                values = uniq.tolist()
+            if render is not None:
+                values = [render(v) for v in values]
+            column = np.array(values, dtype=object)[inverse.ravel()]
+            columns.append(column if arrays else column.tolist())
+        return columns
+
+    def decode_record(self, record):
+        decoded_measurements = self.decode_packet(record.get("data_hex", ""))
+        if not decoded_measurements:
+            return None
+        return {
+            "timestamp": record.get("timestamp"),
+            "imei": record.get("imei"),
+            "decoded_measurements": decoded_measurements
+        }
+
+    # ================= CHECKPOINT =================
+    @staticmethod
+    def load_state(state_file):
+        if not os.path.exists(state_file):
+            return {}
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (ValueError, OSError):
+            return {}
+
+    @staticmethod
+    def save_state(state_file, state):
+        tmp_path = state_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_file)
+
+    def monitor_and_save(self, input_file, output_file, state_file=STATE_FILE):
+        print(f"Monitoring {input_file}... Saving to {output_file}")
+
+        # watch before the first read so appends during startup still wake us
+        watcher = FileWatcher(input_file)
+        print(f"Watching {input_file} ({watcher.mode})")
+
+        # _file_offset / _file_inode: byte position of the next raw record to decode
+        state = self.load_state(state_file)
+        reader = TailReader(input_file, state.get('_file_offset', 0), state.get('_file_inode'))
+
+        # the JSONL output stays, mqtty.py tails it; the dashboard queries the database
+        store = ReadingStore(READINGS_DB) if READINGS_BACKEND == 'sqlite' else None
+
+        # Open output file in append mode ('a'), rotated between batches
+        rotation = LogRotation(output_file)
+        f_out = open(output_file, 'ab')
+        while True:
+            lines = reader.read_lines(BATCH_SIZE)
+            if not lines:
+                watcher.wait(IDLE_RECHECK)
+                continue
+
+            # before the batch is written, so a new day starts in a new file
+            if rotation.due(os.fstat(f_out.fileno()).st_size):
+                f_out.close()
+                rotation.rotate()
+                f_out = open(output_file, 'ab')
+
+            decoded = []
+            for _, line in lines:
                 try:
-                    record = json.loads(line)
-                    decoded_measurements = self.decode_packet(record.get("data_hex", ""))
-                    
-                    if decoded_measurements:
-                        # Construct the requested JSON format
-                        output_entry = {
-                            "timestamp": record.get("timestamp"),
-                            "imei": record.get("imei"),
-                            "decoded_measurements": decoded_measurements
-                        }
-                        
+                    record = decode_raw(line)
+                    output_entry = self.decode_record(record)
+
+                    if output_entry:
                         # Write to JSONL file
-                        f_out.write(json.dumps(output_entry) + "\n")
-                        f_out.flush() # Ensure data is written immediately
-                        
+                        f_out.write(dumps_line(output_entry))
+                        decoded.append(output_entry)
+
                         print(f"Processed: {record.get('timestamp')} | IMEI: {record.get('imei')}")
                 except Exception as e:
                     print(f"Error: {e}")
 
+            f_out.flush() # Ensure data is written before the checkpoint moves
+            if store is not None and decoded:
+                store.insert(decoded)  # one transaction per batch
+
+            state['_file_offset'] = reader.offset
+            state['_file_inode'] = reader.inode
+            self.save_state(state_file, state)
+
+    # ================= OFFLINE BULK DECODE =================
+    def decode_lines_numpy(self, lines):
+        """Decode raw JSONL lines into decord_result.jsonl lines through decode_frames_numpy()."""
+        records = []
+        for line in lines:
+            try:
+                record = decode_raw(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+
+        frames = [r.get("data_hex") if isinstance(r.get("data_hex"), str) else "" for r in records]
+        rows, table, rest = self.decode_frames_numpy(frames)
+        if not rows:
+            rendered = []
+        else:
+            timestamps = [dumps(records[i].get("timestamp")) for i in rows]
+            imeis = [dumps(records[i].get("imei")) for i in rows]
+            template = self.line_template
+            rendered = [template % values for values in zip(timestamps, imeis, *self.numpy_columns(table, dumps))]
+            if len(rows) == len(records):
+                return rendered
+
+        out = [None] * len(records)
+        for i, line in zip(rows, rendered):
+            out[i] = line
+
+        # short data fields, same per-register fallback as decode_frame()
+        for i, decoded in rest.items():
+            if decoded:
+                record = records[i]
+                out[i] = dumps({
+                    "timestamp": record.get("timestamp"),
+                    "imei": record.get("imei"),
+                    "decoded_measurements": decoded
+                }) + "\n"
+
+        return [line for line in out if line is not None]
+
+    def decode_lines(self, lines):
+        """Per-record fallback for bulk_decode() when NumPy is not installed."""
+        out = []
+        for line in lines:
+            try:
+                output_entry = self.decode_record(decode_raw(line))
+            except (ValueError, AttributeError):
+                continue
+            if output_entry:
+                out.append(dumps(output_entry) + "\n")
+        return out
+
+    def bulk_decode(self, input_file, output_file, chunk_size=BULK_CHUNK_SIZE, replace_live=False):
+        """Re-decode a whole archive of raw records (rotated segments included) into output_file in one pass.
+
+        The output is written to a .tmp file and moved into place with
+        os.replace(). The live LIVE_OUTPUT is refused unless replace_live:
+        mqtty.py and app.py tail it by (inode, offset), so after replacing it
+        the sender checkpoint (last_sent_position.txt) has to be reset to the
+        end of the new file, or the whole history is published again.
+        """
+        if not replace_live and os.path.abspath(output_file) == os.path.abspath(LIVE_OUTPUT):
+            raise ValueError(f"{output_file} is the live decoded log, write the backfill to another file")
+
+        decode = self.decode_lines_numpy if np is not None else self.decode_lines
+        total = 0
+
+        tmp_path = output_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f_out:
+            lines, size = [], 0
+            for line in iter_lines(input_file):
+                if line.strip():
+                    lines.append(line.decode('utf-8', errors='replace'))
+                    size += len(line)
+                if size >= chunk_size:
+                    decoded = decode(lines)
+                    f_out.writelines(decoded)
+                    total += len(decoded)
+                    lines, size = [], 0
+            if lines:
+                decoded = decode(lines)
+                f_out.writelines(decoded)
+                total += len(decoded)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(tmp_path, output_file)
+
+        return total
+
+    def benchmark(self, input_file, min_records=200000):
+        """Per-line monitor path vs bulk_decode() on a copy of input_file and its rotated segments."""
+        lines = [line.decode('utf-8', errors='replace') for line in iter_lines(input_file) if line.strip()]
+        if not lines:
+            print("❌ No records to benchmark")
+            return
+
+        lines = lines * max(1, -(-min_records // len(lines)))
+        tmp_dir = tempfile.mkdtemp()
+        src = os.path.join(tmp_dir, "modem_data.jsonl")
+        with open(src, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+
+        per_line_out = os.path.join(tmp_dir, "per_line.jsonl")
+        start = time.perf_counter()
+        with open(src, 'r') as f_in, open(per_line_out, 'w') as f_out:
+            for line in f_in:
+                try:
+                    output_entry = self.decode_record(decode_raw(line))
+                except ValueError:
+                    continue
+                if output_entry:
+                    f_out.write(dumps(output_entry) + "\n")
+        per_line = time.perf_counter() - start
+
+        bulk_out = os.path.join(tmp_dir, "bulk.jsonl")
+        start = time.perf_counter()
+        self.bulk_decode(src, bulk_out)
+        bulk = time.perf_counter() - start
+
+        with open(per_line_out, 'rb') as a, open(bulk_out, 'rb') as b:
+            identical = a.read() == b.read()
+
+        for path in (src, per_line_out, bulk_out):
+            os.remove(path)
+        os.rmdir(tmp_dir)
+
+        mode = "numpy" if np is not None else "pure python"
+        print(f"Records:   {len(lines)}")
+        print(f"Per-line:  {per_line:.2f}s  ({len(lines) / per_line:,.0f} rec/s)")
+        print(f"Bulk ({mode}): {bulk:.2f}s  ({len(lines) / bulk:,.0f} rec/s)")
+        print(f"Speedup:   {per_line / bulk:.1f}x | identical output: {identical}")
+
 if __name__ == "__main__":
     decoder = FlowMeterAccurateDecoder()
-    # Continuous running loop
-    decoder.monitor_and_save('modem_data.jsonl', 'decord_result.jsonl')
\ No newline at end of file
+
+    # python Decription-Test.py bulk [input] [output] [--replace-live]
+    # python Decription-Test.py benchmark [input]
+    if len(sys.argv) > 1 and sys.argv[1] == "bulk":
+        args = [a for a in sys.argv[2:] if a != '--replace-live']
+        replace_live = '--replace-live' in sys.argv
+        input_file = args[0] if len(args) > 0 else 'modem_data.jsonl'
+        output_file = args[1] if len(args) > 1 else BULK_OUTPUT
+        try:
+            count = decoder.bulk_decode(input_file, output_file, replace_live=replace_live)
+        except ValueError as e:
+            print(f"❌ {e} (or pass --replace-live with mqtty.py stopped)")
+            sys.exit(1)
+        print(f"✅ Bulk decoded {count} records into {output_file}")
+        if replace_live:
+            print(f"⚠ {output_file} was replaced: reset last_sent_position.txt to its end before starting mqtty.py")
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        decoder.benchmark(sys.argv[2] if len(sys.argv) > 2 else 'modem_data.jsonl')
+    else:
+        # Continuous running loop
+        decoder.monitor_and_save('modem_data.jsonl', LIVE_OUTPUT)
@@ -1,8 +1,18 @@
-from flask import Flask, render_template, jsonify, request, redirect, session, url_for, abort
-import json, os
+from flask import Flask, render_template, jsonify, request, redirect, session, url_for, abort, Response
+from flask.json.provider import DefaultJSONProvider
+import json, os, queue, itertools
 from datetime import datetime, timedelta
 from functools import wraps
 
+from reading_index import ReadingIndex, time_key, key_seconds
+from reading_store import ReadingStore, StoreIndex, READINGS_DB
+from live_feed import LiveFeed
+from log_export import stream_csv, stream_xlsx
+from rollups import Rollups, PERIODS
+from archive import Archive, ARCHIVE_DIR
+from mqtt_log_index import load_summary, history as mqtt_history
+import json_codec
+
 # ================= CONFIG =================
 DATA_FILE = "decord_result.jsonl"
 SITES_FILE = "sites.json"
@@ -11,13 +21,44 @@ ADMIN_FILE = "admin.json"
 MQTT_MAP_FILE = "device_topic_map.json"
 MQTT_LOG_FILE = "mqtt_logs.jsonl"
 DEVICES_FILE = "devices.json"
+READINGS_BACKEND = os.environ.get("READINGS_BACKEND", "jsonl")  # "jsonl" | "sqlite" (READINGS_DB)
 
 OFFLINE_THRESHOLD = 900
+LOG_PAGE_SIZE = 500    # readings per /api/logs page unless ?limit= asks for fewer/more
+LOG_PAGE_MAX = 5000
+LOG_BUCKETS_MAX = 5000  # chart points per /api/logs?buckets= response
+MQTT_LOG_PAGE_SIZE = 50   # entries per /api/mqtt-logs page unless ?limit= asks for fewer/more
+MQTT_LOG_PAGE_MAX = 500
+STREAM_KEEPALIVE = 15  # seconds between SSE comments so proxies keep idle streams open
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify() and request.json through json_codec (orjson / msgspec)."""
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
 
 app = Flask(__name__)
+if json_codec.codec.backend != "json":
+    app.json = CodecJSONProvider(app)
 app.secret_key = "aarohi-secure-secret"
 app.permanent_session_lifetime = timedelta(minutes=30)
 
+# latest reading per IMEI, updated from the new bytes of DATA_FILE (or new rows of READINGS_DB) on each request
+if READINGS_BACKEND == "sqlite":
+    reading_store = ReadingStore(READINGS_DB)
+    reading_index = StoreIndex(reading_store)
+    READINGS_WATCH = READINGS_DB + "-wal"   # WAL mode, inserts land in the -wal file
+else:
+    reading_store = None
+    reading_index = ReadingIndex(DATA_FILE)
+    READINGS_WATCH = DATA_FILE
+
+# closed days compacted to Parquet by archive.py, read instead of the live data when present
+archive = Archive(ARCHIVE_DIR)
+
 # ================= AUTH DECORATOR =================
 def login_required(fn):
     @wraps(fn)
@@ -36,10 +77,12 @@ def load_json(path):
         return json.load(f)
 
 def load_jsonl(path):
+    if path == DATA_FILE and reading_store is not None:
+        return reading_store.records()
     if not os.path.exists(path):
         return []
-    with open(path, "r", encoding="utf-8") as f:
-        return [json.loads(x) for x in f if x.strip()]
+    with open(path, "rb") as f:
+        return [json_codec.loads(x) for x in f if x.strip()]
 def load_json(path):
     if not os.path.exists(path):
         return {}
@@ -54,7 +97,12 @@ def load_json(path):
         return {}
 
 
-def group_by_imei(records):
+def group_by_imei(records=None):
+    if records is None:
+        # every reading, sorted per IMEI by the (imei, timestamp) index when the store is SQLite
+        if reading_store is not None:
+            return reading_store.by_imei()
+        records = load_jsonl(DATA_FILE)
     result = {}
     for r in records:
         result.setdefault(r["imei"], []).append(r)
@@ -83,7 +131,7 @@ def load_admin():
     return load_json(ADMIN_FILE)
 
 def all_imeis():
-    return list(group_by_imei(load_jsonl(DATA_FILE)).keys())
+    return reading_index.imeis()
 
 def available_imeis():
     used = set()
@@ -91,6 +139,187 @@ def available_imeis():
         used.update(s["modems"])
     return [i for i in all_imeis() if i not in used]
 
+def log_query(imei):
+    """Readings for ?from=&to=&limit= and either cursor= (next page) or since=
+    (appended after the previous poll). Returns (records, next_cursor,
+    has_more, since), records is None for a stale since. Aborts with 400 on
+    bad values."""
+    try:
+        limit = int(request.args.get("limit", LOG_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError(limit)
+        limit = min(limit, LOG_PAGE_MAX)
+        start = request.args.get("from") or None
+        end = request.args.get("to") or None
+
+        since = request.args.get("since")
+        if since:
+            records, since, has_more = reading_index.readings_since(imei, since, start, end, limit)
+            return records, None, has_more, since
+
+        return reading_index.readings(
+            imei,
+            start=start,
+            end=end,
+            limit=limit,
+            cursor=request.args.get("cursor") or None
+        )
+    except ValueError:
+        abort(400)
+
+# the measurements reading_values() uses, the only columns read from the archive
+VALUE_COLUMNS = [
+    "transient_flow", "total_cumulative_whole", "total_cumulative_decimal",
+    "negative_cumulative_whole", "negative_cumulative_decimal", "sampling_value"
+]
+
+def reading_values(record):
+    """(transient flow, positive, negative, sampling) of a decoded record, None if not decoded."""
+    d = record.get("decoded_measurements")
+    if not d:
+        return None
+    positive = (d.get("total_cumulative_whole") or 0) + (d.get("total_cumulative_decimal") or 0)
+    negative = (d.get("negative_cumulative_whole") or 0) + (d.get("negative_cumulative_decimal") or 0)
+    return float(d.get("transient_flow") or 0), positive, negative, d.get("sampling_value") or 0
+
+def history_scan(imei, start=None, end=None):
+    """reading_index.scan() with the archived days read from the archive.
+
+    Days up to archive.through() come from their Parquet partitions (only
+    VALUE_COLUMNS), later days from the live index.
+    """
+    through = archive.through()
+    if not through or (start and start[:10] > through):
+        return reading_index.scan(imei, start, end)
+
+    old = archive.scan(imei, start, end if end and end[:10] <= through else through, VALUE_COLUMNS)
+    # empty when the range ends on an archived day, still gives the since position
+    next_day = (datetime.strptime(through, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    live = reading_index.scan(imei, max(start or "", next_day), end)
+
+    return {
+        "count": old["count"] + live["count"],
+        "first_key": old["first_key"] or live["first_key"],
+        "last_key": live["last_key"] or old["last_key"],
+        "since": live["since"],
+        "records": itertools.chain(old["records"], live["records"])
+    }
+
+def downsample(scan, buckets):
+    """Min / max / avg transient flow and the last cumulative values per time bucket.
+
+    scan is history_scan(), its records are consumed one by one so the
+    range is never held in memory. A range with no more readings than
+    buckets comes back one reading per bucket.
+    """
+    if not scan["count"]:
+        return []
+
+    first = key_seconds(scan["first_key"])
+    span = key_seconds(scan["last_key"]) - first
+    width = span / buckets if scan["count"] > buckets and span > 0 else None
+
+    out = []
+    current = None
+    current_slot = None
+
+    for i, record in enumerate(scan["records"]):
+        values = reading_values(record)
+        if values is None:
+            continue
+        flow, positive, negative, sampling = values
+
+        if width is None:
+            slot = i
+        else:
+            try:
+                seconds = key_seconds(time_key(record["timestamp"]))
+            except (KeyError, ValueError):
+                continue
+            slot = min(buckets - 1, int((seconds - first) / width))
+
+        if slot != current_slot:
+            if current is not None:
+                out.append(current)
+            current_slot = slot
+            current = {
+                "timestamp": record["timestamp"],
+                "end": record["timestamp"],
+                "count": 0,
+                "flow_min": flow,
+                "flow_max": flow,
+                "flow_sum": 0.0
+            }
+
+        current["end"] = record["timestamp"]
+        current["count"] += 1
+        current["flow_min"] = min(current["flow_min"], flow)
+        current["flow_max"] = max(current["flow_max"], flow)
+        current["flow_sum"] += flow
+        current["positive"] = round(positive, 3)
+        current["negative"] = round(negative, 3)
+        current["cumulative"] = round(positive - negative, 3)
+        current["sampling"] = sampling
+
+    if current is not None:
+        out.append(current)
+
+    for bucket in out:
+        bucket["flow_avg"] = round(bucket.pop("flow_sum") / bucket["count"], 3)
+
+    return out
+
+EXPORT_HEADER = [
+    "Timestamp", "Instant Flow", "Cumulative Flow",
+    "Positive Flow", "Negative Flow", "Sampling Value"
+]
+
+def export_rows(records):
+    for record in records:
+        values = reading_values(record)
+        if values is None:
+            continue
+        flow, positive, negative, sampling = values
+        yield [
+            record["timestamp"], flow, round(positive - negative, 3),
+            round(positive, 3), round(negative, 3), sampling
+        ]
+
+def modem_entry(imei, last, now):
+    last_time = datetime.strptime(last["timestamp"], "%Y-%m-%d %H:%M:%S")
+    online = (now - last_time).total_seconds() <= OFFLINE_THRESHOLD
+
+    return {
+        "imei": imei,
+        "last_seen": last["timestamp"],
+        "status": "ONLINE" if online else "OFFLINE"
+    }
+
+# one shared tail of DATA_FILE / READINGS_DB feeds every /api/stream client
+live_feed = LiveFeed(reading_index, READINGS_WATCH, modem_entry)
+
+# hourly / daily consumption per IMEI: archived days are loaded once, the index feeds the rest
+rollups = Rollups(reading_values)
+archived_through = archive.through()
+if archived_through:
+    for records in archive.batches(VALUE_COLUMNS):
+        rollups.add(records)
+
+def index_to_rollups(records):
+    if archived_through:
+        records = [r for r in records if r["timestamp"][:10] > archived_through]
+    rollups.add(records)
+
+reading_index.listeners.append(index_to_rollups)
+
+def rollup_args():
+    period = request.args.get("period", "day")
+    if period not in PERIODS:
+        abort(400)
+    # brings the rollups up to date with the readings
+    reading_index.refresh()
+    return period, request.args.get("from") or None, request.args.get("to") or None
+
 # ================= MQTT HELPERS =================
 def load_mqtt_map():
     return load_json(MQTT_MAP_FILE)
@@ -99,18 +328,11 @@ def save_mqtt_map(data):
     with open(MQTT_MAP_FILE, "w") as f:
         json.dump(data, f, indent=2)
 
-def mqtt_last_sent():
-    last = {}
-    if not os.path.exists(MQTT_LOG_FILE):
-        return last
-    with open(MQTT_LOG_FILE, "r") as f:
-        for line in f:
-            try:
-                r = json.loads(line)
-                last[r["imei"]] = r["timestamp"]
-            except:
-                pass
-    return last
+def mqtt_last_sent(summary=None):
+    # upload_time of the last successful upload, from the summary the sender keeps
+    if summary is None:
+        summary = load_summary(MQTT_LOG_FILE)
+    return {imei: s["last_success"] for imei, s in summary.items() if s.get("last_success")}
 # ✅ ONLY VALID SITES (FIX)
 def valid_sites_only():
     sites = load_sites()
@@ -149,7 +371,7 @@ def save_devices(data):
 
 def all_imeis():
     devices = set(load_devices().keys())
-    mqtt = set(group_by_imei(load_jsonl(DATA_FILE)).keys())
+    mqtt = set(reading_index.imeis())
     return sorted(devices | mqtt)
 # ================= LOGIN =================
 @app.route("/")
@@ -209,25 +431,168 @@ def logout():
 @login_required
 def api_modems():
     now = datetime.now()
-    result = []
 
-    for imei, logs in group_by_imei(load_jsonl(DATA_FILE)).items():
-        last = logs[-1]
-        last_time = datetime.strptime(last["timestamp"], "%Y-%m-%d %H:%M:%S")
-        online = (now - last_time).total_seconds() <= OFFLINE_THRESHOLD
+    if "since" not in request.args:
+        return jsonify([
+            modem_entry(imei, last, now)
+            for imei, last in reading_index.latest().items()
+        ])
 
-        result.append({
-            "imei": imei,
-            "last_seen": last["timestamp"],
-            "status": "ONLINE" if online else "OFFLINE"
-        })
-
-    return jsonify(result)
+    # ?since= (empty on the first poll) answers only the modems that changed,
+    # the cursor is "<data file position>@<time of the previous poll>"
+    since = request.args.get("since")
+    try:
+        position, polled_at = since.split("@") if since else (None, "0")
+        polled_at = float(polled_at)
+        changed, position = reading_index.changed_since(position)
+    except ValueError:
+        abort(400)
+
+    reset = changed is None or not since
+    if changed is None:
+        changed, position = reading_index.changed_since(None)
+
+    if not reset:
+        # no new reading, but OFFLINE_THRESHOLD ran out since the previous poll
+        window_start = polled_at - OFFLINE_THRESHOLD
+        window_end = now.timestamp() - OFFLINE_THRESHOLD
+        for imei, last in reading_index.latest().items():
+            if imei in changed:
+                continue
+            t = datetime.strptime(last["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+            if window_start < t <= window_end:
+                changed[imei] = last
+
+    return jsonify({
+        "modems": [modem_entry(imei, last, now) for imei, last in changed.items()],
+        "since": f"{position}@{now.timestamp():.0f}",
+        "reset": reset
+    })
 
 @app.route("/api/logs/<imei>")
 @login_required
 def api_logs(imei):
-    return jsonify([r for r in load_jsonl(DATA_FILE) if r["imei"] == imei])
+    if request.args.get("buckets"):
+        # long ranges for charts: one summary per time bucket instead of every reading
+        try:
+            buckets = int(request.args["buckets"])
+        except ValueError:
+            abort(400)
+        if not 1 <= buckets <= LOG_BUCKETS_MAX:
+            abort(400)
+
+        scan = history_scan(
+            imei,
+            start=request.args.get("from") or None,
+            end=request.args.get("to") or None
+        )
+        return jsonify({
+            "buckets": downsample(scan, buckets),
+            "readings": scan["count"],
+            "since": scan["since"]
+        })
+
+    records, next_cursor, has_more, since = log_query(imei)
+    return jsonify({
+        "records": records or [],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "since": since,
+        "reset": records is None
+    })
+
+@app.route("/api/logs/<imei>/export")
+@login_required
+def api_logs_export(imei):
+    """?format=csv|xlsx&from=&to=, streamed row by row from the archive and the indexed data."""
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "xlsx"):
+        abort(400)
+
+    scan = history_scan(
+        imei,
+        start=request.args.get("from") or None,
+        end=request.args.get("to") or None
+    )
+    rows = export_rows(scan["records"])
+    filename = "IMEI_" + "".join(c for c in imei if c.isalnum()) + "_Logs." + fmt
+
+    if fmt == "csv":
+        body = stream_csv(EXPORT_HEADER, rows)
+        mimetype = "text/csv"
+    else:
+        body = stream_xlsx(EXPORT_HEADER, rows)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+    return Response(
+        body,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ================= ROLLUP API =================
+@app.route("/api/rollups/<imei>")
+@login_required
+def api_rollups(imei):
+    """?period=hour|day&from=&to=, volume / reverse / flow per period for one modem."""
+    period, start, end = rollup_args()
+    return jsonify(rollups.series(imei, period, start, end))
+
+@app.route("/api/site-rollups/<name>")
+@login_required
+def api_site_rollups(name):
+    sites = load_sites()
+    if name not in sites:
+        abort(404)
+    if session.get("role") != "admin" and name not in session.get("sites", []):
+        abort(403)
+
+    period, start, end = rollup_args()
+    return jsonify(rollups.site_series(sites[name].get("modems", []), period, start, end))
+
+@app.route("/api/consumption")
+@login_required
+def api_consumption():
+    """imei -> {volume, reverse, count} between ?from= and ?to= (days, default today)."""
+    if session.get("role") != "admin":
+        abort(403)
+
+    _, start, end = rollup_args()
+    today = datetime.now().strftime("%Y-%m-%d")
+    return jsonify(rollups.totals(all_imeis(), start or today, end or today))
+
+@app.route("/api/stream")
+@login_required
+def api_stream():
+    """Server-Sent Events: "reading" for new records, "modem" for last seen /
+    status changes, "resync" when the client fell behind. ?imei= (repeatable)
+    limits the stream to those modems, ?events= (repeatable or comma
+    separated, e.g. events=modem) to those event types."""
+    imeis = set(request.args.getlist("imei"))
+    wanted_types = {e for value in request.args.getlist("events") for e in value.split(",") if e}
+    q = live_feed.subscribe(wanted_types)
+
+    def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = q.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if imeis and data.get("imei") not in imeis and event != "resync":
+                    continue
+                yield f"event: {event}\ndata: {json_codec.dumps(data)}\n\n"
+        finally:
+            live_feed.unsubscribe(q)
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/api/available-modems")
 @login_required
 def api_available_modems():
@@ -269,10 +634,12 @@ def api_users():
 @login_required
 def api_mqtt_portal():
     if request.method == "GET":
+        summary = load_summary(MQTT_LOG_FILE)
         return jsonify({
             "imeis": all_imeis(),
             "mapping": load_mqtt_map(),
-            "last_sent": mqtt_last_sent()
+            "last_sent": mqtt_last_sent(summary),
+            "summary": summary
         })
     save_mqtt_map(request.json)
     return jsonify({"status": "saved"})
@@ -280,17 +647,26 @@ def api_mqtt_portal():
 @app.route("/api/mqtt-logs/<imei>")
 @login_required
 def api_mqtt_logs(imei):
-    logs = []
-    if os.path.exists(MQTT_LOG_FILE):
-        with open(MQTT_LOG_FILE, "r") as f:
-            for line in f:
-                try:
-                    r = json.loads(line)
-                    if r.get("imei") == imei:
-                        logs.append(r)
-                except:
-                    pass
-    return jsonify(logs)
+    """Newest first, ?limit= entries per page, ?cursor= is next_cursor of the previous page."""
+    try:
+        limit = int(request.args.get("limit", MQTT_LOG_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError(limit)
+        logs, next_cursor, has_more, total = mqtt_history(
+            imei,
+            min(limit, MQTT_LOG_PAGE_MAX),
+            request.args.get("cursor") or None,
+            MQTT_LOG_FILE
+        )
+    except ValueError:
+        abort(400)
+    return jsonify({
+        "logs": logs,
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "total": total,
+        "summary": load_summary(MQTT_LOG_FILE).get(imei)
+    })
 
 # ================= PAGES =================
 @app.route("/")
@@ -390,10 +766,7 @@ def view_user_sites(username):
         abort(404)
 
     now = datetime.now()
-    last_map = {
-        imei: logs[-1]["timestamp"]
-        for imei, logs in group_by_imei(load_jsonl(DATA_FILE)).items()
-    }
+    last_map = reading_index.last_seen()
 
     user_sites = {}
 
@@ -432,10 +805,7 @@ def user_dashboard():
 
     sites = valid_sites_only()
     now = datetime.now()
-    last_map = {}
-
-    for imei, logs in group_by_imei(load_jsonl(DATA_FILE)).items():
-        last_map[imei] = logs[-1]["timestamp"]
+    last_map = reading_index.last_seen()
 
     dashboard = {}
 
@@ -470,9 +840,13 @@ def user_report():
     now = datetime.now()
 
     # map last seen time
-    last_map = {}
-    for imei, logs in group_by_imei(load_jsonl(DATA_FILE)).items():
-        last_map[imei] = logs[-1]["timestamp"]
+    last_map = reading_index.last_seen()
+
+    # consumption from the daily rollups
+    today = datetime.now()
+    imeis = [m for s in session.get("sites", []) for m in sites.get(s, {}).get("modems", [])]
+    today_volume = rollups.totals(imeis, today.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d"))
+    month_volume = rollups.totals(imeis, (today - timedelta(days=29)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d"))
 
     rows = []
 
@@ -493,7 +867,9 @@ def user_report():
             rows.append({
                 "imei": imei,
                 "status": status,
-                "last_seen": last
+                "last_seen": last,
+                "today_volume": today_volume[imei]["volume"],
+                "month_volume": month_volume[imei]["volume"]
             })
 
     return render_template("user_report.html", rows=rows)
@@ -543,8 +919,15 @@ def user_logs(imei):
     if imei not in allowed:
         abort(403)
 
-    logs = [l for l in load_jsonl(DATA_FILE) if l["imei"] == imei]
-    return render_template("user_logs.html", imei=imei, logs=logs)
+    logs, next_cursor, has_more, _ = log_query(imei)
+    return render_template(
+        "user_logs.html",
+        imei=imei,
+        logs=logs,
+        next_cursor=next_cursor if has_more else None,
+        time_from=request.args.get("from", ""),
+        time_to=request.args.get("to", "")
+    )
 
 # ================= RUN =================
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+
+from reading_index import time_key
+from log_rotation import iter_lines
+from json_codec import loads
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# ================= CONFIG =================
+ARCHIVE_DIR = "archive"
+RAW_FILE = "modem_data.jsonl"
+DECODED_FILE = "decord_result.jsonl"
+SOURCES = {"raw": RAW_FILE, "decoded": DECODED_FILE}
+
+FLUSH_ROWS = 200000    # rows buffered by compact() before the partitions are written out
+READ_BATCH = 5000      # rows per batch when reading a partition back
+COMPRESSION = "zstd"
+
+# ================= ROW CONVERSION =================
+# raw: data_text and data_hex are both derived from the received bytes, only the bytes are kept
+RAW_COLUMNS = ["timestamp", "protocol", "ip", "port", "data"]
+
+def _raw_row(record):
+    try:
+        data = bytes.fromhex(record.get("data_hex", ""))
+    except (TypeError, ValueError):
+        data = b""
+    return {
+        "timestamp": record["timestamp"],
+        "protocol": record.get("protocol"),
+        "ip": record.get("ip"),
+        "port": record.get("port"),
+        "data": data
+    }
+
+def _raw_record(imei, row):
+    data = row.pop("data") or b""
+    row["imei"] = imei
+    row["data_text"] = data.decode(errors="ignore")
+    row["data_hex"] = data.hex()
+    return row
+
+# decoded: one column per measurement instead of the key names repeated on every line
+def _decoded_row(record):
+    row = dict(record.get("decoded_measurements") or {})
+    row["timestamp"] = record["timestamp"]
+    return row
+
+def _decoded_record(imei, row):
+    timestamp = row.pop("timestamp")
+    return {
+        "timestamp": timestamp,
+        "imei": imei,
+        "decoded_measurements": {k: v for k, v in row.items() if v is not None}
+    }
+
+ROWS = {"raw": _raw_row, "decoded": _decoded_row}
+RECORDS = {"raw": _raw_record, "decoded": _decoded_record}
+
+def _rows(table):
+    # dicts per row, converted column by column (faster than to_pylist())
+    for batch in table.to_batches(max_chunksize=READ_BATCH):
+        columns = batch.to_pydict()
+        names = list(columns)
+        for values in zip(*columns.values()):
+            yield dict(zip(names, values))
+
+def _table(rows):
+    # columns are the union of the row keys, a field missing from a row is null
+    names = {}
+    for row in rows:
+        names.update(dict.fromkeys(row))
+    return pa.table({name: [row.get(name) for row in rows] for name in names})
+
+# ================= ARCHIVE =================
+class Archive:
+    """Closed days of modem_data.jsonl / decord_result.jsonl as Parquet files.
+
+    Layout: <root>/<raw|decoded>/date=YYYY-MM-DD/imei=<imei>/part-N.parquet
+    (Hive partitioning, so other Arrow / Parquet tools read it as is) and
+    <root>/manifest.json with the last compacted day per kind. Readers only
+    open the partitions of the days and IMEI asked for and only the columns
+    asked for. pyarrow is optional: without it available is False and
+    through() returns None, so callers keep reading the JSONL files.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+
+    @property
+    def available(self):
+        return pq is not None
+
+    # ---------- MANIFEST ----------
+    def _manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def through(self, kind="decoded"):
+        """Last day ("YYYY-MM-DD") fully held in the archive, None if nothing is."""
+        if not self.available:
+            return None
+        return self._manifest().get(kind)
+
+    # ---------- PARTITIONS ----------
+    def _day_dir(self, kind, day):
+        return os.path.join(self.root, kind, f"date={day}")
+
+    def _days(self, kind, start=None, end=None):
+        # archived days between start and end (inclusive), oldest first
+        try:
+            names = os.listdir(os.path.join(self.root, kind))
+        except FileNotFoundError:
+            return []
+        through = self.through(kind)
+        if through is None:
+            return []
+        days = sorted(n[5:] for n in names if n.startswith("date="))
+        return [
+            d for d in days
+            if d <= through
+            and (not start or d >= start[:10])
+            and (not end or d <= end[:10])
+        ]
+
+    def _parts(self, kind, day, imei):
+        path = os.path.join(self._day_dir(kind, day), f"imei={imei}")
+        try:
+            return [os.path.join(path, n) for n in sorted(os.listdir(path)) if n.endswith(".parquet")]
+        except FileNotFoundError:
+            return []
+
+    def _day_table(self, kind, day, imei, columns, lo, hi):
+        # one IMEI-day sorted by time, only the requested columns, rows outside lo..hi dropped
+        tables = []
+        for path in self._parts(kind, day, imei):
+            f = pq.ParquetFile(path)
+            names = f.schema_arrow.names
+            wanted = names if columns is None else [c for c in ["timestamp"] + columns if c in names]
+            tables.append(f.read(columns=wanted))
+        if not tables:
+            return None
+
+        table = tables[0] if len(tables) == 1 else pa.concat_tables(tables, promote_options="default")
+        if lo > time_key(day) or hi < time_key(day, "9"):
+            keys = [time_key(t) for t in table.column("timestamp").to_pylist()]
+            table = table.filter(pa.array([lo <= k <= hi for k in keys]))
+        return table.sort_by("timestamp")
+
+    # ---------- READ ----------
+    def scan(self, imei, start=None, end=None, columns=None, kind="decoded"):
+        """Archived records of one IMEI between start and end, shaped like ReadingIndex.scan().
+
+        columns limits which fields are read (measurements for "decoded",
+        RAW_COLUMNS for "raw"), None reads all. count comes from the Parquet
+        footers for whole days, so only the first and last day are read up
+        front; records is a generator that reads one IMEI-day at a time.
+        """
+        if not self.available:
+            return {"count": 0, "first_key": None, "last_key": None, "records": iter(())}
+
+        lo = time_key(start) if start else 0
+        hi = time_key(end, "9") if end else 99999999999999
+        days = [d for d in self._days(kind, start, end) if self._parts(kind, d, imei)]
+
+        count = 0
+        edge_tables = {}
+        for i, day in enumerate(days):
+            if i == 0 or i == len(days) - 1 or lo > time_key(day) or hi < time_key(day, "9"):
+                edge_tables[day] = self._day_table(kind, day, imei, columns, lo, hi)
+                count += edge_tables[day].num_rows
+            else:
+                count += sum(pq.ParquetFile(p).metadata.num_rows for p in self._parts(kind, day, imei))
+
+        def stamps(day):
+            table = edge_tables[day] if day in edge_tables else self._day_table(kind, day, imei, [], lo, hi)
+            return table.column("timestamp")
+
+        # an edge day can be empty once filtered, the key then comes from the next day with rows
+        first_key = last_key = None
+        if count:
+            first_key = next(time_key(c[0].as_py()) for c in map(stamps, days) if len(c))
+            last_key = next(time_key(c[-1].as_py()) for c in map(stamps, reversed(days)) if len(c))
+
+        def records():
+            to_record = RECORDS[kind]
+            for day in days:
+                table = edge_tables.pop(day, None)
+                if table is None:
+                    table = self._day_table(kind, day, imei, columns, lo, hi)
+                for row in _rows(table):
+                    yield to_record(imei, row)
+
+        return {"count": count, "first_key": first_key, "last_key": last_key, "records": records()}
+
+    def batches(self, columns=None, kind="decoded"):
+        """Lists of archived records for every IMEI-day, e.g. to rebuild aggregates."""
+        if not self.available:
+            return
+        for day in self._days(kind):
+            day_dir = self._day_dir(kind, day)
+            for name in sorted(os.listdir(day_dir)):
+                if not name.startswith("imei="):
+                    continue
+                imei = name[5:]
+                table = self._day_table(kind, day, imei, columns, 0, 99999999999999)
+                if table is None:
+                    continue
+                to_record = RECORDS[kind]
+                yield [to_record(imei, row) for row in _rows(table)]
+
+    # ---------- COMPACTION ----------
+    def compact(self, kind, source=None, before=None):
+        """Move every day before `before` (default today) that is not archived yet into Parquet.
+
+        Streams the source JSONL (rotated segments included) once and writes a part file per IMEI-day each
+        time FLUSH_ROWS rows are buffered. The manifest only moves after all
+        parts are written, partitions of later days left by an interrupted
+        run are removed first. The JSONL file itself is not modified.
+        Returns (rows archived, JSONL bytes of those rows, Parquet bytes written).
+        """
+        if not self.available:
+            raise RuntimeError("pyarrow is not installed")
+
+        source = source or SOURCES[kind]
+        before = before or datetime.now().strftime("%Y-%m-%d")
+        through = self.through(kind) or ""
+        to_row = ROWS[kind]
+
+        kind_dir = os.path.join(self.root, kind)
+        os.makedirs(kind_dir, exist_ok=True)
+        for name in os.listdir(kind_dir):
+            if name.startswith("date=") and name[5:] > through:
+                shutil.rmtree(os.path.join(kind_dir, name))
+
+        buffers = {}          # (day, imei) -> rows
+        parts = {}            # (day, imei) -> part files written so far
+        buffered = rows_archived = source_bytes = parquet_bytes = 0
+
+        def flush():
+            nonlocal buffered, parquet_bytes
+            for (day, imei), rows in buffers.items():
+                path = os.path.join(self._day_dir(kind, day), f"imei={imei}")
+                os.makedirs(path, exist_ok=True)
+                n = parts.get((day, imei), 0)
+                parts[(day, imei)] = n + 1
+                target = os.path.join(path, f"part-{n}.parquet")
+                pq.write_table(_table(rows), target, compression=COMPRESSION)
+                parquet_bytes += os.path.getsize(target)
+            buffers.clear()
+            buffered = 0
+
+        for line in iter_lines(source):
+            try:
+                record = loads(line)
+                day = record["timestamp"][:10]
+                imei = record["imei"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if day <= through or day >= before:
+                continue
+
+            buffers.setdefault((day, imei), []).append(to_row(record))
+            buffered += 1
+            rows_archived += 1
+            source_bytes += len(line)
+            if buffered >= FLUSH_ROWS:
+                flush()
+        flush()
+
+        # every day up to before is closed, days without data included
+        manifest = self._manifest()
+        manifest[kind] = max(through, (datetime.strptime(before, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d"))
+        self._save_manifest(manifest)
+        return rows_archived, source_bytes, parquet_bytes
+
+# ================= COMPACTION JOB =================
+if __name__ == "__main__":
+    # python archive.py compact [raw|decoded|all] [--before YYYY-MM-DD]
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("Usage: python archive.py compact [raw|decoded|all] [--before YYYY-MM-DD]")
+        sys.exit(1)
+    if pq is None:
+        print("❌ pyarrow is not installed (pip install pyarrow)")
+        sys.exit(1)
+
+    args = sys.argv[2:]
+    before = None
+    if "--before" in args:
+        i = args.index("--before")
+        before = args[i + 1]
+        del args[i:i + 2]
+    kinds = ["raw", "decoded"] if not args or args[0] == "all" else [args[0]]
+
+    archive = Archive()
+    for kind in kinds:
+        if not os.path.exists(SOURCES[kind]):
+            print(f"⚠ {SOURCES[kind]} not found, skipping {kind}")
+            continue
+        started = time.perf_counter()
+        rows, source_bytes, parquet_bytes = archive.compact(kind, before=before)
+        ratio = f", {source_bytes / parquet_bytes:.1f}x smaller" if parquet_bytes else ""
+        print(
+            f"✅ {kind}: {rows} rows archived through {archive.through(kind)} "
+            f"({source_bytes / 1e6:.1f} MB JSONL -> {parquet_bytes / 1e6:.1f} MB Parquet{ratio}) "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
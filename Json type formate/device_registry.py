@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+import atexit
+
+# ================= DEVICE REGISTRY =================
+class DeviceRegistry:
+    """In-memory copy of devices.json shared by all modem connections.
+
+    The file is only re-read when its inode / mtime / size changes (e.g. the
+    dashboard added a device) and first_seen / last_seen updates are written
+    back in one atomic rewrite every flush_interval seconds.
+    """
+
+    def __init__(self, path, flush_interval=2.0, check_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.devices = {}
+        self.pending = {}        # imei -> fields changed since last flush
+        self.file_id = None
+        self.last_check = 0.0
+
+        with self.lock:
+            self._reload_if_changed(force=True)
+
+    # ---------- FILE STATE ----------
+    def _stat_id(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self, force=False):
+        # caller holds self.lock, False when the file could not be read
+        now = time.monotonic()
+        if not force and now - self.last_check < self.check_interval:
+            return True
+        self.last_check = now
+
+        file_id = self._stat_id()
+        if file_id == self.file_id:
+            return True
+
+        if file_id is None:
+            devices = {}
+        else:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    devices = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                # file is being rewritten right now, keep the old copy and retry
+                return False
+
+        # unflushed first_seen / last_seen updates win over the file contents
+        for imei, fields in self.pending.items():
+            if imei in devices:
+                devices[imei].update(fields)
+
+        self.devices = devices
+        self.file_id = file_id
+        return True
+
+    # ---------- LOOKUP / UPDATE ----------
+    def get(self, imei):
+        with self.lock:
+            self._reload_if_changed()
+            return self.devices.get(imei)
+
+    def touch(self, imei, now):
+        with self.lock:
+            device = self.devices.get(imei)
+            if device is None:
+                return
+            fields = self.pending.setdefault(imei, {})
+            if not device.get("first_seen"):
+                device["first_seen"] = now
+                fields["first_seen"] = now
+            device["last_seen"] = now
+            fields["last_seen"] = now
+
+    # ---------- FLUSH ----------
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                # pick up devices added on disk so they are not overwritten; while
+                # the dashboard is mid-write the file cannot be read, and replacing
+                # it with the old copy would lose that write, so wait for next cycle
+                if not self._reload_if_changed(force=True):
+                    return
+                content = json.dumps(self.devices, indent=2)
+                flushed = self.pending
+                self.pending = {}
+
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    # the id of our own write, os.replace() keeps inode and mtime;
+                    # a stat after it could already see a dashboard rewrite
+                    st = os.fstat(f.fileno())
+                    file_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                # keep the updates for the next attempt, newer ones win
+                with self.lock:
+                    for imei, fields in flushed.items():
+                        fields.update(self.pending.get(imei, {}))
+                        self.pending[imei] = fields
+                raise
+
+            with self.lock:
+                self.file_id = file_id
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠ Device registry flush failed: {e}")
+
+    def start(self):
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
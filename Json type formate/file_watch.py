@@ -0,0 +1,266 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from log_rotation import find_segment, load_segments, open_segment
+
+# ================= INOTIFY =================
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+# ================= FILE WATCHER =================
+class FileWatcher:
+    """Wakes a tailer as soon as a file grows or is replaced.
+
+    Uses inotify on the file's directory on Linux (so creation and rotation
+    are seen too) and falls back to stat polling elsewhere. Create the
+    watcher before the first read so no append can slip in unnoticed.
+    """
+
+    def __init__(self, path, poll_interval=0.5):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path).encode()
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.last_stat = self._stat()
+
+        if _libc is not None:
+            fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                directory = os.path.dirname(self.path).encode()
+                if _libc.inotify_add_watch(fd, directory, WATCH_MASK) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def wait(self, timeout=None):
+        """Block until the file changes (True) or timeout seconds pass (False)."""
+        if self.fd is not None:
+            return self._wait_inotify(timeout)
+        return self._wait_poll(timeout)
+
+    def _wait_inotify(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return False
+
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            # events for other files in the same directory are ignored
+            pos = 0
+            changed = False
+            while pos + EVENT_HEADER.size <= len(data):
+                _, _, _, name_len = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = data[pos:pos + name_len].rstrip(b"\0")
+                pos += name_len
+                if name == self.name:
+                    changed = True
+            if changed:
+                return True
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def _wait_poll(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            current = self._stat()
+            if current != self.last_stat:
+                self.last_stat = current
+                return True
+
+            if deadline is None:
+                time.sleep(self.poll_interval)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# ================= TAIL READER =================
+class TailReader:
+    """Reads complete lines appended to a file, resuming from a byte offset.
+
+    Checkpoints are (offset, inode). One whose inode belongs to a segment in
+    the rotation manifest (log_rotation.py) resumes inside that segment,
+    gzipped or not, and carries on through the later segments to the live
+    file, so nothing is skipped across rotations. Any other mismatch (other
+    inode, or past the end after truncation) restarts at 0. Rotation is only
+    followed once the old file has been read to the end, and a partially
+    written last line is left for the next call.
+    """
+
+    def __init__(self, path, offset=0, inode=None):
+        self.path = path
+        self.offset = offset
+        self.inode = inode
+        self.file = None
+        self.segment = None   # manifest entry while reading a closed segment
+
+    def _open(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            f = None
+        st = os.fstat(f.fileno()) if f is not None else None
+
+        if self.inode is not None and (st is None or self.inode != st.st_ino):
+            segments = load_segments(self.path)
+            found = next(((i, e) for i, e in enumerate(segments) if e["inode"] == self.inode), None)
+            if found is None and segments:
+                # not the live file and no longer listed: expired, everything older is gone too
+                print(f"⚠ {self.path} segment {self.inode} was removed, resuming at the oldest segment left")
+                found = (0, segments[0])
+                self.offset = 0
+            if found is not None:
+                if f is not None:
+                    f.close()
+                return self._open_segment(found[1], self.offset)
+
+        if f is None:
+            return False
+
+        if self.inode is not None and self.inode != st.st_ino:
+            print(f"↻ {self.path} was rotated, starting from the beginning")
+            self.offset = 0
+        elif self.offset > st.st_size:
+            print(f"↻ {self.path} was truncated, starting from the beginning")
+            self.offset = 0
+
+        if self.offset > 0:
+            # resume on a line boundary, a partial line was already handled
+            f.seek(self.offset - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+        else:
+            f.seek(0)
+
+        self.file = f
+        self.offset = f.tell()
+        self.inode = st.st_ino
+        self.segment = None
+        return True
+
+    def _open_segment(self, entry, offset):
+        try:
+            f = open_segment(self.path, entry)
+        except FileNotFoundError:
+            self.inode = entry["inode"]
+            if find_segment(self.path, entry["inode"]) is not None:
+                # listed but gone (deleted by hand), carry on with the next one
+                print(f"⚠ {entry['file']} is missing, skipping it")
+                return self._advance()
+            # removed by retention meanwhile, _open() resumes at the oldest segment left
+            self.offset = 0
+            return self._open()
+
+        if offset > 0:
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+
+        self.file = f
+        self.offset = f.tell()
+        self.inode = entry["inode"]
+        self.segment = entry
+        return True
+
+    def _advance(self):
+        # current file is finished: next segment after it in the manifest, else the live file
+        self.close()
+        segments = load_segments(self.path)
+        inodes = [e["inode"] for e in segments]
+        if self.inode in inodes and inodes.index(self.inode) + 1 < len(segments):
+            return self._open_segment(segments[inodes.index(self.inode) + 1], 0)
+        self.offset = 0
+        self.inode = None
+        return self._open()
+
+    def _replaced(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return st.st_ino != self.inode or st.st_size < self.offset
+
+    def read_lines(self, max_lines=None):
+        """List of (offset, line) for new complete lines, offset is where the line starts."""
+        if self.file is None and not self._open():
+            return []
+
+        lines = []
+        while max_lines is None or len(lines) < max_lines:
+            line = self.file.readline()
+            if not line:
+                break
+            if not line.endswith(b"\n"):
+                if self.segment is not None:
+                    # a closed segment never grows, its torn last line is dropped
+                    print(f"⚠ Skipping incomplete last line of {self.segment['file']}")
+                    self.offset += len(line)
+                    break
+                # record still being written, pick it up on the next call
+                self.file.seek(self.offset)
+                break
+            lines.append((self.offset, line))
+            self.offset += len(line)
+
+        if not lines and (self.segment is not None or self._replaced()):
+            if self._advance():
+                return self.read_lines(max_lines)
+
+        return lines
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,216 @@
+import json
+import os
+import sys
+import time
+from typing import TypedDict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# ================= CONFIG =================
+JSON_CODEC = os.environ.get("JSON_CODEC", "auto")   # "auto" | "orjson" | "msgspec" | "json"
+
+# ================= RECORD SHAPES =================
+# Only the fields the readers use. With msgspec a line is decoded straight
+# into these (other fields, like data_text of a raw record, are skipped
+# instead of built), a line that does not fit is decoded generically.
+
+class RawRecord(TypedDict, total=False):
+    # modem_data.jsonl, as read by the decoder
+    timestamp: str
+    imei: str
+    data_hex: str
+
+class DecodedRecord(TypedDict, total=False):
+    # decord_result.jsonl
+    timestamp: str
+    imei: str
+    decoded_measurements: dict[str, Union[int, float, None]]
+
+class MqttLogEntry(TypedDict, total=False):
+    # mqtt_logs.jsonl, as summarised by mqtt_log_index.py
+    imei: str
+    status: str
+    upload_time: str
+    sent_at: str
+    time: str
+    error: str
+
+SHAPES = {"raw": RawRecord, "reading": DecodedRecord, "mqtt_log": MqttLogEntry}
+
+def available_backends():
+    return ["json"] + [name for name, lib in (("orjson", orjson), ("msgspec", msgspec)) if lib is not None]
+
+# ================= CODEC =================
+class Codec:
+    """JSON for the JSONL hot paths, orjson / msgspec when installed, stdlib json otherwise.
+
+    backend "auto" encodes and decodes with orjson (else msgspec) and uses
+    msgspec for the typed decoders when it is installed. Every backend
+    reads what the others write. Output differs only in spacing (the fast
+    libraries write no blanks after "," and ":"), SEPARATORS gives the
+    current one. NaN / Infinity are written as null by the fast backends,
+    stdlib style NaN lines from older files still decode. Decoding errors
+    are ValueError on every backend.
+    """
+
+    def __init__(self, backend="auto"):
+        if backend == "auto":
+            backend = "orjson" if orjson is not None else "msgspec" if msgspec is not None else "json"
+        if backend not in available_backends():
+            print(f"⚠ JSON backend {backend} is not installed, using json")
+            backend = "json"
+        self.backend = backend
+
+        if backend == "orjson":
+            options = orjson.OPT_NON_STR_KEYS
+            self._loads = orjson.loads
+            self._dumps_bytes = lambda obj: orjson.dumps(obj, option=options)
+            self._dumps_line = lambda obj: orjson.dumps(obj, option=options | orjson.OPT_APPEND_NEWLINE)
+        elif backend == "msgspec":
+            encode = msgspec.json.Encoder().encode
+            self._loads = msgspec.json.Decoder().decode
+            self._dumps_bytes = encode
+            self._dumps_line = lambda obj: encode(obj) + b"\n"
+        else:
+            self._loads = json.loads
+            self._dumps_bytes = lambda obj: json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self._dumps_line = lambda obj: (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+        self.separators = (", ", ": ") if backend == "json" else (",", ":")
+
+        # msgspec decodes into the record shapes whenever it is there, unless json was asked for
+        self._typed = {}
+        if msgspec is not None and backend != "json":
+            self._typed = {name: msgspec.json.Decoder(shape).decode for name, shape in SHAPES.items()}
+
+    # ---------- GENERIC ----------
+    def loads(self, data):
+        """str or bytes -> Python object, ValueError if it is not JSON."""
+        try:
+            return self._loads(data)
+        except ValueError:
+            if self.backend == "json":
+                raise
+            return json.loads(data)   # NaN / Infinity written by stdlib json
+
+    def dumps(self, obj):
+        return self._dumps_bytes(obj).decode("utf-8")
+
+    def dumps_bytes(self, obj):
+        return self._dumps_bytes(obj)
+
+    def dumps_line(self, obj):
+        """One JSONL line as UTF-8 bytes, newline included."""
+        return self._dumps_line(obj)
+
+    # ---------- TYPED ----------
+    def decode(self, shape, data):
+        """A line as a dict of one of the SHAPES ("raw", "reading", "mqtt_log").
+
+        With msgspec only the fields of the shape are kept, otherwise (and
+        for lines that do not fit the shape) every field is.
+        """
+        typed = self._typed.get(shape)
+        if typed is not None:
+            try:
+                return typed(data)
+            except ValueError:
+                pass
+        return self.loads(data)
+
+codec = Codec(JSON_CODEC)
+
+loads = codec.loads
+dumps = codec.dumps
+dumps_bytes = codec.dumps_bytes
+dumps_line = codec.dumps_line
+SEPARATORS = codec.separators
+
+def decode_raw(data):
+    return codec.decode("raw", data)
+
+def decode_reading(data):
+    return codec.decode("reading", data)
+
+def decode_mqtt_log(data):
+    return codec.decode("mqtt_log", data)
+
+# ================= BENCHMARK =================
+def _sample(path, records):
+    try:
+        with open(path, "rb") as f:
+            lines = [line for line in f if line.strip()][:records]
+    except FileNotFoundError:
+        return []
+    return lines * max(1, -(-records // len(lines))) if lines else []
+
+def _stages(raw_lines, decoded_lines, mqtt_lines):
+    # the JSON work each stage does per line, as (name, lines, fn(codec, line))
+    raw_records = [json.loads(line) for line in raw_lines]
+    decoded_records = [json.loads(line) for line in decoded_lines]
+
+    def server(c, record):
+        c.dumps_line(record)
+
+    def decoder(c, line):
+        record = c.decode("raw", line)
+        c.dumps_line({"timestamp": record.get("timestamp"), "imei": record.get("imei"), "decoded_measurements": {}})
+
+    def mqtty(c, line):
+        record = c.decode("reading", line)
+        c.dumps({"version": "1.0", "onlinetag": record["imei"], "payload": [record["decoded_measurements"]]})
+
+    def dashboard(c, line):
+        c.loads(line)
+
+    def reading_index(c, line):
+        c.decode("reading", line)
+
+    def mqtt_log(c, line):
+        c.decode("mqtt_log", line)
+
+    return [
+        ("server.py log_json (encode raw)", raw_records, server),
+        ("Decription-Test.py (decode raw + encode)", raw_lines, decoder),
+        ("mqtty.py (decode reading + payload)", decoded_lines, mqtty),
+        ("app.py load_jsonl (decode)", decoded_lines, dashboard),
+        ("reading_index.py (typed decode)", decoded_lines, reading_index),
+        ("mqtt_log_index.py (typed decode)", mqtt_lines, mqtt_log),
+    ]
+
+def benchmark(raw_file="modem_data.jsonl", decoded_file="decord_result.jsonl",
+              mqtt_file="mqtt_logs.jsonl", records=200000):
+    """Seconds per stage for every installed backend, on lines sampled from the data files."""
+    backends = {name: Codec(name) for name in available_backends()}
+    stages = _stages(_sample(raw_file, records), _sample(decoded_file, records), _sample(mqtt_file, records))
+
+    print(f"Records per stage: {records} | backends: {', '.join(backends)}")
+    for name, lines, fn in stages:
+        if not lines:
+            print(f"{name:45} no sample data")
+            continue
+        times = {}
+        for backend, c in backends.items():
+            started = time.perf_counter()
+            for line in lines:
+                fn(c, line)
+            times[backend] = time.perf_counter() - started
+        columns = "  ".join(
+            f"{backend} {t:.2f}s ({times['json'] / t:.1f}x)" for backend, t in times.items()
+        )
+        print(f"{name:45} {columns}")
+
+if __name__ == "__main__":
+    # python json_codec.py benchmark [records]
+    if len(sys.argv) < 2 or sys.argv[1] != "benchmark":
+        print(f"Usage: python json_codec.py benchmark [records]   (active backend: {codec.backend})")
+        sys.exit(1)
+    benchmark(records=int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
@@ -0,0 +1,131 @@
+import os
+import queue
+import threading
+import time
+import atexit
+
+from json_codec import dumps_line
+
+_STOP = object()
+
+# ================= JSONL WRITER =================
+class JsonlWriter:
+    """Appends records to a JSONL file from one background thread.
+
+    Records from all producers are queued and written in group commits: a
+    batch is written once it holds max_batch records or the oldest record
+    has waited max_latency seconds. The file stays open between batches.
+
+    fsync policy: "never" (leave it to the OS), "batch" (after every group
+    commit) or a number of seconds between fsyncs. With a LogRotation the
+    file is rotated between group commits when it is due.
+    """
+
+    def __init__(self, path, max_batch=500, max_latency=0.2, fsync="never", rotation=None):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.rotation = rotation
+
+        if fsync in ("never", "batch"):
+            self.fsync_policy = fsync
+            self.fsync_interval = None
+        else:
+            self.fsync_policy = "interval"
+            self.fsync_interval = float(fsync)
+
+        self.queue = queue.Queue()
+        self.thread = None
+        self.file = None
+        self.last_fsync = time.monotonic()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        self.queue.put(record)
+
+    def close(self):
+        if self.thread and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    # ---------- WRITER THREAD ----------
+    def _next_batch(self):
+        first = self.queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _rotate_if_due(self):
+        # before the batch is written, so a new day starts in a new file
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if not self.rotation.due(size):
+            return
+        if self.file is not None:
+            if self.fsync_policy != "never":
+                os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+        self.rotation.rotate()
+
+    def _commit(self, batch):
+        if self.rotation is not None:
+            self._rotate_if_due()
+        if self.file is None:
+            self.file = open(self.path, "ab")
+
+        self.file.write(b"".join(map(dumps_line, batch)))
+        self.file.flush()
+
+        if self.fsync_policy == "batch":
+            os.fsync(self.file.fileno())
+        elif self.fsync_policy == "interval":
+            now = time.monotonic()
+            if now - self.last_fsync >= self.fsync_interval:
+                os.fsync(self.file.fileno())
+                self.last_fsync = now
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._commit(batch)
+            except OSError as e:
+                print(f"⚠ Write to {self.path} failed, {len(batch)} records lost: {e}")
+                if self.file is not None:
+                    try:
+                        self.file.close()
+                    except OSError:
+                        pass
+                self.file = None
+
+        if self.file is not None:
+            if self.fsync_policy != "never":
+                os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
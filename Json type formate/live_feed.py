@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+from file_watch import FileWatcher
+
+# ================= LIVE FEED =================
+class LiveFeed:
+    """Pushes new readings and modem status changes to Server-Sent Events clients.
+
+    One watcher thread follows the data file through the shared ReadingIndex,
+    so every viewer costs one open connection instead of a polling loop.
+    Readings indexed by a request thread are pushed too. Events are
+    ("reading", {imei, timestamp, record}) and ("modem", describe(...)) when
+    a modem's last reading or ONLINE/OFFLINE status changes. A subscriber
+    can ask for some event types only, "resync" is always delivered. A
+    subscriber that falls queue_size events behind gets one ("resync", {})
+    instead.
+    """
+
+    def __init__(self, index, path, describe, check_interval=5.0, queue_size=1000):
+        self.index = index
+        self.path = path
+        self.describe = describe          # (imei, record, now) -> {"imei", "last_seen", "status"}
+        self.check_interval = check_interval
+        self.queue_size = queue_size
+
+        self.lock = threading.Lock()
+        self.subscribers = {}             # queue -> set of event types, None for all
+        self.modems = {}                  # imei -> last pushed state
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+
+        # existing history is the starting state, not a burst of events
+        now = datetime.now()
+        states = {
+            imei: self.describe(imei, record, now)
+            for imei, record in self.index.latest().items()
+        }
+        with self.lock:
+            self.modems = states
+
+        self.index.listeners.append(self._on_records)
+        self.thread.start()
+
+    # ---------- SUBSCRIBERS ----------
+    def subscribe(self, events=None):
+        self.start()
+        q = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers[q] = set(events) if events else None
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.pop(q, None)
+
+    def _push(self, event, data):
+        # caller holds self.lock
+        for q, events in self.subscribers.items():
+            if events is not None and event not in events:
+                continue
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(("resync", {}))
+
+    # ---------- EVENTS ----------
+    def _on_records(self, records):
+        now = datetime.now()
+        with self.lock:
+            for record in records:
+                imei = record["imei"]
+                self._push("reading", {
+                    "imei": imei,
+                    "timestamp": record["timestamp"],
+                    "record": record
+                })
+
+                last = self.modems.get(imei)
+                if last is None or record["timestamp"] >= last["last_seen"]:
+                    state = self.describe(imei, record, now)
+                    self.modems[imei] = state
+                    self._push("modem", state)
+
+    def _check_status(self):
+        # ONLINE modems that stayed quiet past the threshold, no reading announces that
+        now = datetime.now()
+        with self.lock:
+            for imei, state in list(self.modems.items()):
+                if state["status"] != "ONLINE":
+                    continue
+                fresh = self.describe(imei, {"timestamp": state["last_seen"]}, now)
+                if fresh["status"] != state["status"]:
+                    self.modems[imei] = fresh
+                    self._push("modem", fresh)
+
+    def _run(self):
+        watcher = FileWatcher(self.path)
+        next_check = time.monotonic() + self.check_interval
+
+        while True:
+            watcher.wait(self.check_interval)
+            try:
+                self.index.refresh()
+            except Exception as e:
+                print(f"⚠ Live feed refresh failed: {e}")
+
+            if time.monotonic() >= next_check:
+                self._check_status()
+                next_check = time.monotonic() + self.check_interval
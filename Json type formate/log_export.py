@@ -0,0 +1,148 @@
+import csv
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+# ================= CONFIG =================
+CHUNK_SIZE = 64 * 1024        # bytes buffered before a chunk is handed to the response
+XLSX_MAX_ROWS = 1048576       # Excel's row limit per sheet, the header included
+
+# ================= CSV =================
+def stream_csv(header, rows):
+    """CSV text chunks for header + rows, rows may be any iterable (e.g. a generator)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue()
+
+# ================= XLSX =================
+class _ChunkSink:
+    """Write-only file object for zipfile, collects what it writes until drained."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+def _cell(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+    return f"<c><v>{value}</v></c>"
+
+def _row(values):
+    return "<row>" + "".join(_cell(v) for v in values) + "</row>"
+
+SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_TAIL = "</sheetData></worksheet>"
+
+def _workbook_parts(sheet_names):
+    sheets = "".join(
+        f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(sheet_names, 1)
+    )
+    rels = "".join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    return {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            f"{overrides}</Types>"
+        ),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'
+        ),
+        "xl/workbook.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f"<sheets>{sheets}</sheets></workbook>"
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f"{rels}</Relationships>"
+        )
+    }
+
+def stream_xlsx(header, rows, sheet_name="Logs"):
+    """XLSX bytes chunks for header + rows, written as the rows are consumed.
+
+    The zip is written to a non-seekable sink (sizes go in data descriptors)
+    and the sheets use inline strings, so memory stays flat for any number
+    of rows. Past Excel's row limit the rows continue on "<sheet_name> 2", ...
+    """
+    sink = _ChunkSink()
+    zf = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    sheet_names = []
+    sheet_rows = 0
+    header_xml = _row(header).encode()
+
+    def open_sheet():
+        sheet_names.append(sheet_name if not sheet_names else f"{sheet_name} {len(sheet_names) + 1}")
+        f = zf.open(f"xl/worksheets/sheet{len(sheet_names)}.xml", "w", force_zip64=True)
+        f.write(SHEET_HEAD.encode())
+        f.write(header_xml)
+        return f
+
+    sheet = open_sheet()
+    for row in rows:
+        sheet_rows += 1
+        if sheet_rows >= XLSX_MAX_ROWS:
+            sheet.write(SHEET_TAIL.encode())
+            sheet.close()
+            sheet = open_sheet()
+            sheet_rows = 1
+
+        sheet.write(_row(row).encode())
+        if sink.size >= CHUNK_SIZE:
+            yield sink.drain()
+
+    sheet.write(SHEET_TAIL.encode())
+    sheet.close()
+
+    for name, content in _workbook_parts(sheet_names).items():
+        zf.writestr(name, content)
+    zf.close()
+
+    yield sink.drain()
@@ -0,0 +1,273 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+# ================= CONFIG =================
+ROTATE_BYTES = int(float(os.environ.get("LOG_ROTATE_MB", "256")) * 1024 * 1024)  # 0 disables size rotation
+ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN", "daily")        # "daily" | "hourly" | "never"
+COMPRESS = os.environ.get("LOG_COMPRESS", "1") == "1"           # gzip closed segments
+RETAIN_DAYS = float(os.environ.get("LOG_RETAIN_DAYS", "0"))     # delete older segments, 0 keeps all
+
+PERIOD_FORMATS = {
+    "daily": "%Y%m%d",
+    "hourly": "%Y%m%d%H"
+}
+
+# ================= SEGMENT MANIFEST =================
+# <log>.segments.json lists the closed segments of <log>, oldest first:
+#   {"file", "inode" (of the log when it was closed), "size" (uncompressed), "closed", "compressed"}
+# The inode is what TailReader checkpoints store, so a reader finds its segment
+# again after rotation and compression.
+
+def manifest_path(path):
+    return path + ".segments.json"
+
+def _load_manifest(path):
+    try:
+        with open(manifest_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_segments(path):
+    """Closed segments of a log, oldest first."""
+    return _load_manifest(path).get("segments", [])
+
+def find_segment(path, inode):
+    """(position, entry) of the segment that had this inode, None if not a known segment."""
+    for i, entry in enumerate(load_segments(path)):
+        if entry["inode"] == inode:
+            return i, entry
+    return None
+
+def segment_file(path, entry):
+    return os.path.join(os.path.dirname(path), entry["file"])
+
+def open_segment(path, entry):
+    """Binary file object for a closed segment, decompressed if it is gzipped.
+
+    The manifest is read again once if the file was compressed in between.
+    """
+    for _ in range(2):
+        name = segment_file(path, entry)
+        try:
+            return gzip.open(name, "rb") if entry.get("compressed") else open(name, "rb")
+        except FileNotFoundError:
+            found = find_segment(path, entry["inode"])
+            if found is None:
+                raise
+            entry = found[1]
+    raise FileNotFoundError(segment_file(path, entry))
+
+def iter_lines(path):
+    """Every line (bytes) of a log: closed segments oldest first, then the live file."""
+    for entry in load_segments(path):
+        try:
+            f = open_segment(path, entry)
+        except FileNotFoundError:
+            continue  # removed by retention
+        with f:
+            yield from f
+
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        yield from f
+
+# ================= ROTATION =================
+class LogRotation:
+    """Size and time based rotation of one append-only log, run by its writer.
+
+    The writer asks due(size) after a write and, with its file closed,
+    calls rotate(): the live file is renamed to <name>-YYYYMMDD-HHMMSS<ext>
+    and listed in the segment manifest before the rename, so a reader never
+    sees a segment it cannot find. A fresh live file is created with an
+    inode no listed segment had. Closed segments are gzipped and
+    retention is applied in a background thread.
+    """
+
+    def __init__(self, path, max_bytes=ROTATE_BYTES, when=ROTATE_WHEN,
+                 compress=COMPRESS, retain_days=RETAIN_DAYS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.format = PERIOD_FORMATS.get(when)
+        self.compress = compress
+        self.retain_days = retain_days
+
+        self.lock = threading.Lock()            # manifest updates
+        self.maintain_lock = threading.Lock()   # one compression / retention pass at a time
+
+        with self.lock:
+            manifest = _load_manifest(path)
+            self._recover(manifest)
+            inode = self._inode()
+            if inode is None:
+                inode = self._fresh_file({e["inode"] for e in manifest.get("segments", [])})
+
+            # the period the live file was started in survives restarts
+            hot = manifest.get("hot", {})
+            self.period = hot.get("period") if hot.get("inode") == inode else None
+            if self.period is None:
+                self.period = self._period()
+                manifest["hot"] = {"inode": inode, "period": self.period}
+                self._save(manifest)
+
+        self._maintain_async()
+
+    def _inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _period(self):
+        return datetime.now().strftime(self.format) if self.format else None
+
+    def _save(self, manifest):
+        target = manifest_path(self.path)
+        tmp_path = target + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, target)
+
+    def _recover(self, manifest):
+        # caller holds self.lock: a crash between the manifest write and the rename
+        segments = manifest.get("segments", [])
+        if segments and segments[-1]["inode"] == self._inode():
+            last = segments[-1]
+            if not os.path.exists(segment_file(self.path, last)):
+                os.rename(self.path, segment_file(self.path, last))
+
+    # ---------- ROTATE ----------
+    def due(self, size):
+        """True when the live file (size bytes) should be rotated now."""
+        if size <= 0:
+            return False
+        if self.max_bytes and size >= self.max_bytes:
+            return True
+        return self.format is not None and self._period() != self.period
+
+    def rotate(self):
+        """Close the live file into a segment, the writer reopens path afterwards."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_size == 0:
+            self.period = self._period()
+            return
+
+        base, ext = os.path.splitext(os.path.basename(self.path))
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        name = f"{base}-{stamp}{ext}"
+        n = 1
+        while os.path.exists(os.path.join(os.path.dirname(self.path), name)) \
+                or os.path.exists(os.path.join(os.path.dirname(self.path), name + ".gz")):
+            name = f"{base}-{stamp}-{n}{ext}"
+            n += 1
+
+        entry = {
+            "file": name,
+            "inode": st.st_ino,
+            "size": st.st_size,
+            "closed": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "compressed": False
+        }
+
+        with self.lock:
+            manifest = _load_manifest(self.path)
+            manifest.setdefault("segments", []).append(entry)
+            self._save(manifest)
+            os.rename(self.path, segment_file(self.path, entry))
+
+            inode = self._fresh_file({e["inode"] for e in manifest["segments"]})
+            self.period = self._period()
+            manifest["hot"] = {"inode": inode, "period": self.period}
+            self._save(manifest)
+
+        print(f"↻ Rotated {self.path} -> {name} ({st.st_size / 1e6:.1f} MB)")
+        self._maintain_async()
+
+    def _fresh_file(self, taken):
+        # an inode freed by a compressed segment must not come back as the live file,
+        # checkpoints pointing at that segment would resume in the wrong file
+        holders = []
+        while True:
+            open(self.path, "a").close()
+            inode = os.stat(self.path).st_ino
+            if inode not in taken:
+                break
+            holder = f"{self.path}.hold{len(holders)}"
+            os.rename(self.path, holder)
+            holders.append(holder)
+        for holder in holders:
+            os.remove(holder)
+        return inode
+
+    # ---------- COMPRESSION / RETENTION ----------
+    def _maintain_async(self):
+        if self.compress or self.retain_days:
+            threading.Thread(target=self.maintain, daemon=True).start()
+
+    def maintain(self):
+        """gzip uncompressed segments and drop the ones past retain_days."""
+        with self.maintain_lock:
+            try:
+                if self.compress:
+                    for entry in load_segments(self.path):
+                        if not entry.get("compressed"):
+                            self._compress(entry)
+                if self.retain_days:
+                    self._expire()
+            except OSError as e:
+                print(f"⚠ Segment maintenance for {self.path} failed: {e}")
+
+    def _compress(self, entry):
+        source = segment_file(self.path, entry)
+        target = source + ".gz"
+        tmp_path = target + ".tmp"
+        with open(source, "rb") as f_in, open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(filename=os.path.basename(source), mode="wb", fileobj=raw) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, target)
+
+        with self.lock:
+            manifest = _load_manifest(self.path)
+            for e in manifest.get("segments", []):
+                if e["inode"] == entry["inode"]:
+                    e["file"] = os.path.basename(target)
+                    e["compressed"] = True
+            self._save(manifest)
+        # readers that already opened the plain file keep reading it
+        os.remove(source)
+
+    def _expire(self):
+        cutoff = time.time() - self.retain_days * 86400
+        with self.lock:
+            manifest = _load_manifest(self.path)
+            segments = manifest.get("segments", [])
+            expired = [
+                e for e in segments
+                if datetime.strptime(e["closed"], "%Y-%m-%d %H:%M:%S").timestamp() < cutoff
+            ]
+            if not expired:
+                return
+            manifest["segments"] = [e for e in segments if e not in expired]
+            self._save(manifest)
+
+        for entry in expired:
+            try:
+                os.remove(segment_file(self.path, entry))
+            except FileNotFoundError:
+                pass
+            print(f"🗑 Removed {entry['file']} (older than {self.retain_days:g} days)")
@@ -0,0 +1,113 @@
+import threading
+
+# ================= FRAME FORMAT =================
+# NB<header>,<IMEI>,<binary data>,END
+FRAME_START = b"NB"
+FRAME_END = b",END"
+MAX_FRAME_SIZE = 4096
+
+STAT_KEYS = (
+    "frames",           # complete frames emitted
+    "split_frames",     # frames that arrived over more than one recv()
+    "merged_reads",     # recv() results that carried more than one frame
+    "dropped_partial",  # incomplete frames left when the modem disconnected
+    "oversize",         # frame starts that never ended within MAX_FRAME_SIZE
+    "loose_bytes"       # bytes outside any NB...END frame
+)
+
+frame_totals = dict.fromkeys(STAT_KEYS, 0)
+frame_totals_lock = threading.Lock()
+
+# ================= FRAME BUFFER =================
+class FrameBuffer:
+    """Per-connection reassembly of NB...END frames from a TCP byte stream.
+
+    feed() returns a list of (is_frame, payload) tuples in arrival order.
+    Loose payloads are bytes outside any frame (e.g. an "IMEI:..." hello).
+    The counts in stats are added to frame_totals as they grow, so the
+    totals include connections that are still open.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buf = bytearray()
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+        self.published = dict.fromkeys(STAT_KEYS, 0)
+
+    def feed(self, data):
+        buf = self.buf
+        carried_frame = buf.startswith(FRAME_START)
+        buf += data
+
+        out = []
+        frames = 0
+        pos = 0
+
+        while pos < len(buf):
+            start = buf.find(FRAME_START, pos)
+
+            if start < 0:
+                # a trailing "N" may be the first byte of the next frame
+                loose_end = len(buf) - 1 if buf.endswith(b"N") else len(buf)
+                self._loose(out, buf, pos, loose_end)
+                pos = loose_end
+                break
+
+            self._loose(out, buf, pos, start)
+            pos = start
+
+            # the end marker is searched for after the IMEI field
+            imei_comma = buf.find(b",", start)
+            data_comma = buf.find(b",", imei_comma + 1) if imei_comma >= 0 else -1
+            end = buf.find(FRAME_END, data_comma) if data_comma >= 0 else -1
+
+            if end < 0:
+                if len(buf) - start > self.max_frame_size:
+                    self.stats["oversize"] += 1
+                    self.stats["loose_bytes"] += len(FRAME_START)
+                    pos = start + len(FRAME_START)
+                    continue
+                break
+
+            stop = end + len(FRAME_END)
+            out.append((True, bytes(buf[start:stop])))
+            pos = stop
+
+            if frames == 0 and carried_frame and start == 0:
+                self.stats["split_frames"] += 1
+            frames += 1
+
+        del buf[:pos]
+
+        self.stats["frames"] += frames
+        if frames > 1:
+            self.stats["merged_reads"] += 1
+
+        self._publish()
+        return out
+
+    def _loose(self, out, buf, start, stop):
+        if stop <= start:
+            return
+        self.stats["loose_bytes"] += stop - start
+        chunk = bytes(buf[start:stop])
+        if chunk.strip():
+            out.append((False, chunk))
+
+    def close(self):
+        if self.buf.startswith(FRAME_START):
+            self.stats["dropped_partial"] += 1
+        self.buf.clear()
+
+        self._publish()
+        return self.stats
+
+    def _publish(self):
+        # add what changed since the last call to the shared totals
+        delta = {key: value - self.published[key] for key, value in self.stats.items() if value != self.published[key]}
+        if not delta:
+            return
+        with frame_totals_lock:
+            for key, value in delta.items():
+                frame_totals[key] += value
+        self.published.update(self.stats)
@@ -0,0 +1,383 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+from log_rotation import load_segments, find_segment, open_segment
+from json_codec import loads, dumps_bytes, decode_mqtt_log
+
+# ================= CONFIG =================
+MQTT_LOG_FILE = "mqtt_logs.jsonl"
+SAVE_INTERVAL = 2.0     # seconds between summary writes while uploads keep coming
+FLUSH_LINES = 100000    # lines indexed on start / rebuild before the index files are appended
+
+SUCCESS_STATUSES = ("SUCCESS", "SENT")   # "SENT" lines come from older sender versions
+ENTRY = struct.Struct("<QQ")             # inode, byte offset of one log line
+
+# ================= FILES =================
+# <log>.summary.json   {"position": {"inode", "offset"} of the end of the summarised log,
+#                       "imeis": {imei: {last_success, last_failure, last_error,
+#                                        success_count, failure_count, indexed}}}
+# <log>.index/<imei>.idx   one ENTRY per log line of that IMEI, oldest first
+# Both are written by the sender only (mqtty.py), the dashboard just reads them.
+# Until the sender has written a summary (an older mqtty.py still running, or
+# before its first start after the upgrade) the readers scan the log into
+# memory instead, see ScannedLog. To have the files right away, run
+# "python mqtt_log_index.py rebuild" with the sender stopped.
+
+def summary_path(path):
+    return path + ".summary.json"
+
+def index_dir(path):
+    return path + ".index"
+
+def index_file(path, imei):
+    name = imei if imei.isalnum() else imei.encode().hex()
+    return os.path.join(index_dir(path), name + ".idx")
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+def upload_time(entry):
+    # upload_time from the current sender, sent_at / time from older lines and ERROR lines
+    return entry.get("upload_time") or entry.get("sent_at") or entry.get("time")
+
+def _lines_from(path, inode=None, offset=0):
+    """(inode, offset, line) of every log line after inode:offset, LookupError if that file is gone."""
+    segments = load_segments(path)
+    live = _inode(path)
+    first = 0
+    if inode is not None:
+        found = find_segment(path, inode)
+        if found is not None:
+            first = found[0]
+        elif inode == live:
+            first = len(segments)
+        else:
+            raise LookupError(inode)
+
+    for entry in segments[first:]:
+        try:
+            f = open_segment(path, entry)
+        except FileNotFoundError:
+            continue  # removed by retention
+        with f:
+            position = offset if entry["inode"] == inode else 0
+            f.seek(position)
+            for line in f:
+                yield entry["inode"], position, line
+                position += len(line)
+
+    if live is None:
+        return
+    with open(path, "rb") as f:
+        position = offset if live == inode else 0
+        if position > os.fstat(f.fileno()).st_size:
+            raise LookupError(inode)  # truncated
+        f.seek(position)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # still being written
+            yield live, position, line
+            position += len(line)
+
+# ================= WRITER =================
+class MqttLogIndex:
+    """Per-IMEI upload summary and offset index of mqtt_logs.jsonl, kept by the sender.
+
+    add() is called under the sender's log lock for every line it appends,
+    with the inode and offset the line was written at. The offset index is
+    appended right away, the summary is rewritten at most every
+    SAVE_INTERVAL seconds (save(force=True) when idle). The summary records
+    the log position it covers and how many index entries each IMEI had, so
+    on start the index is cut back to that and the lines after the position
+    are added again, across rotated segments. Without a usable summary the
+    whole log is indexed once.
+    """
+
+    def __init__(self, path=MQTT_LOG_FILE, save_interval=SAVE_INTERVAL, catch_up=True):
+        self.path = path
+        self.save_interval = save_interval
+        self.imeis = {}
+        self.position = {"inode": None, "offset": 0}
+        self.dirty = False
+        self.next_save = 0.0
+
+        os.makedirs(index_dir(path), exist_ok=True)
+        if not catch_up:
+            return
+        started = time.perf_counter()
+        added = self._catch_up()
+        if added:
+            self.save(force=True)
+            print(f"📇 Indexed {added} MQTT log lines in {time.perf_counter() - started:.1f}s")
+
+    # ---------- STARTUP ----------
+    def _catch_up(self):
+        summary = load_summary_file(self.path)
+        if summary and self._restore(summary):
+            try:
+                return self._add_lines(self.position["inode"], self.position["offset"])
+            except LookupError:
+                pass
+        if summary:
+            print(f"⚠ {summary_path(self.path)} does not match the log, re-indexing it")
+        return self.rebuild()
+
+    def _restore(self, summary):
+        # cut every index file back to the count the summary was saved with
+        imeis = summary.get("imeis", {})
+        known = {os.path.basename(index_file(self.path, imei)): imei for imei in imeis}
+        for name in os.listdir(index_dir(self.path)):
+            if name not in known:
+                os.remove(os.path.join(index_dir(self.path), name))
+        for imei, s in imeis.items():
+            target = index_file(self.path, imei)
+            size = s.get("indexed", 0) * ENTRY.size
+            try:
+                if os.path.getsize(target) < size:
+                    return False   # index writes were lost, summary is ahead of them
+                os.truncate(target, size)
+            except FileNotFoundError:
+                if size:
+                    return False
+        self.imeis = imeis
+        self.position = summary.get("position", self.position)
+        return True
+
+    def rebuild(self):
+        """Index the whole log (rotated segments first) from scratch, returns the number of lines."""
+        for name in os.listdir(index_dir(self.path)):
+            os.remove(os.path.join(index_dir(self.path), name))
+        self.imeis = {}
+        self.position = {"inode": None, "offset": 0}
+        return self._add_lines(None, 0)
+
+    def _add_lines(self, inode, offset):
+        added = 0
+        pending = {}   # imei -> index entries, written per file instead of per line
+
+        def flush():
+            for imei, entries in pending.items():
+                with open(index_file(self.path, imei), "ab") as f:
+                    f.write(b"".join(entries))
+            pending.clear()
+
+        for inode, offset, line in _lines_from(self.path, inode, offset):
+            try:
+                entry = decode_mqtt_log(line)
+            except ValueError:
+                entry = {}
+            imei = self._count(entry, inode, offset + len(line))
+            if imei is not None:
+                pending.setdefault(imei, []).append(ENTRY.pack(inode, offset))
+            added += 1
+            if added % FLUSH_LINES == 0:
+                flush()
+        flush()
+        self.dirty = self.dirty or added > 0
+        return added
+
+    # ---------- WRITE ----------
+    def _count(self, entry, inode, end):
+        # summary update for one line, returns its IMEI (None for lines without one)
+        self.position = {"inode": inode, "offset": end}
+        imei = entry.get("imei") if isinstance(entry, dict) else None
+        if not isinstance(imei, str):
+            return None
+
+        s = self.imeis.get(imei)
+        if s is None:
+            s = self.imeis[imei] = {
+                "last_success": None,
+                "last_failure": None,
+                "last_error": None,
+                "success_count": 0,
+                "failure_count": 0,
+                "indexed": 0
+            }
+        if entry.get("status") in SUCCESS_STATUSES:
+            s["last_success"] = upload_time(entry)
+            s["success_count"] += 1
+        else:
+            s["last_failure"] = upload_time(entry)
+            s["last_error"] = entry.get("error") or entry.get("status")
+            s["failure_count"] += 1
+        s["indexed"] += 1
+        return imei
+
+    def add(self, entry, inode, offset, length):
+        """Record a line the sender has just appended at inode:offset (caller holds the log lock)."""
+        imei = self._count(entry, inode, offset + length)
+        if imei is not None:
+            with open(index_file(self.path, imei), "ab") as f:
+                f.write(ENTRY.pack(inode, offset))
+        self.dirty = True
+        self.save()
+
+    def save(self, force=False):
+        """Write the summary if it changed, at most every save_interval seconds unless force."""
+        if not self.dirty or (not force and time.monotonic() < self.next_save):
+            return
+        target = summary_path(self.path)
+        tmp_path = target + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(dumps_bytes({"position": self.position, "imeis": self.imeis}))
+        os.replace(tmp_path, target)
+        self.dirty = False
+        self.next_save = time.monotonic() + self.save_interval
+
+# ================= READ-ONLY FALLBACK =================
+class ScannedLog(MqttLogIndex):
+    """The summary and offset index of a log kept in memory, for logs without a summary file.
+
+    Writes nothing. update() adds the lines appended since the last call,
+    or scans again from the start when the file it stopped in is gone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.imeis = {}
+        self.position = {"inode": None, "offset": 0}
+        self.positions = {}   # imei -> [(inode, offset)], oldest first
+
+    def update(self):
+        try:
+            self._scan(self.position["inode"], self.position["offset"])
+        except LookupError:
+            self.__init__(self.path)
+            self._scan(None, 0)
+
+    def _scan(self, inode, offset):
+        for inode, offset, line in _lines_from(self.path, inode, offset):
+            try:
+                entry = decode_mqtt_log(line)
+            except ValueError:
+                entry = {}
+            imei = self._count(entry, inode, offset + len(line))
+            if imei is not None:
+                self.positions.setdefault(imei, []).append((inode, offset))
+
+_scanned = {}   # path -> ScannedLog
+_scanned_lock = threading.Lock()
+
+def _scanned_log(path):
+    # caller holds _scanned_lock, None once the sender keeps the summary
+    if os.path.exists(summary_path(path)):
+        _scanned.pop(path, None)
+        return None
+    scanned = _scanned.get(path)
+    if scanned is None:
+        scanned = _scanned[path] = ScannedLog(path)
+    scanned.update()
+    return scanned
+
+# ================= READERS =================
+def load_summary_file(path=MQTT_LOG_FILE):
+    try:
+        with open(summary_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_summary(path=MQTT_LOG_FILE):
+    """imei -> {last_success, last_failure, last_error, success_count, failure_count}."""
+    with _scanned_lock:
+        scanned = _scanned_log(path)
+        if scanned is not None:
+            imeis = {imei: dict(s) for imei, s in scanned.imeis.items()}
+    if scanned is None:
+        imeis = load_summary_file(path).get("imeis", {})
+    for s in imeis.values():
+        s.pop("indexed", None)
+    return imeis
+
+def _read_entries(path, positions):
+    # log lines at (inode, offset), grouped per file and read in offset order
+    # (a gzipped segment can only seek forward cheaply)
+    live = _inode(path)
+    by_inode = {}
+    for inode, offset in positions:
+        by_inode.setdefault(inode, []).append(offset)
+
+    entries = {}
+    for inode, offsets in by_inode.items():
+        try:
+            if inode == live:
+                f = open(path, "rb")
+            else:
+                found = find_segment(path, inode)
+                if found is None:
+                    continue  # removed by retention
+                f = open_segment(path, found[1])
+        except FileNotFoundError:
+            continue
+        with f:
+            for offset in sorted(offsets):
+                f.seek(offset)
+                try:
+                    entries[(inode, offset)] = loads(f.readline())
+                except ValueError:
+                    pass
+    return [entries[p] for p in positions if p in entries]
+
+def history(imei, limit=50, cursor=None, path=MQTT_LOG_FILE):
+    """One page of an IMEI's log entries, newest first.
+
+    Returns (entries, next_cursor, has_more, total). cursor is the
+    next_cursor of the previous page (the number of index entries older
+    than it), None starts at the newest entry. Costs one seek in the index
+    plus one per entry, however long the history is. Entries whose segment
+    was removed by retention are left out. Raises ValueError for a
+    malformed cursor. Without a summary file the page comes from ScannedLog.
+    """
+    stop = None
+    if cursor is not None:
+        stop = int(cursor)
+        if stop < 0:
+            raise ValueError(cursor)
+
+    with _scanned_lock:
+        scanned = _scanned_log(path)
+        if scanned is not None:
+            indexed = scanned.positions.get(imei, [])
+            total = len(indexed)
+            stop = total if stop is None else min(stop, total)
+            first = max(0, stop - limit)
+            positions = indexed[first:stop]
+
+    if scanned is None:
+        try:
+            f = open(index_file(path, imei), "rb")
+        except FileNotFoundError:
+            return [], None, False, 0
+        with f:
+            total = os.fstat(f.fileno()).st_size // ENTRY.size
+            stop = total if stop is None else min(stop, total)
+            first = max(0, stop - limit)
+            f.seek(first * ENTRY.size)
+            data = f.read((stop - first) * ENTRY.size)
+        positions = [ENTRY.unpack_from(data, i) for i in range(0, len(data) - len(data) % ENTRY.size, ENTRY.size)]
+
+    positions.reverse()
+    has_more = first > 0
+    return _read_entries(path, positions), str(first) if has_more else None, has_more, total
+
+# ================= REBUILD TOOL =================
+if __name__ == "__main__":
+    # python mqtt_log_index.py rebuild [mqtt_logs.jsonl]   (with the sender stopped)
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python mqtt_log_index.py rebuild [mqtt_logs.jsonl]")
+        sys.exit(1)
+
+    source = sys.argv[2] if len(sys.argv) > 2 else MQTT_LOG_FILE
+    index = MqttLogIndex(source, catch_up=False)
+    started = time.perf_counter()
+    total = index.rebuild()
+    index.save(force=True)
+    print(f"✅ Indexed {total} lines for {len(index.imeis)} IMEIs in {time.perf_counter() - started:.1f}s")
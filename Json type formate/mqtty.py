@@ -2,9 +2,19 @@ import json
 import time
 import ssl
 import os
+import random
+import threading
+import queue
+import zlib
 from datetime import datetime
 import paho.mqtt.client as mqtt
 
+from file_watch import FileWatcher, TailReader
+from log_rotation import LogRotation
+from mqtt_log_index import MqttLogIndex
+from json_codec import dumps_bytes, dumps_line, decode_reading
+from outbound_queue import OutboundQueue, get_last_position, CHECKPOINT_INTERVAL
+
 # ================= MQTT CONFIG =================
 MQTT_SERVER = "watersupply-scada.gujarat.gov.in"
 MQTT_PORT = 8883
@@ -18,10 +28,24 @@ TOPIC_MAP_FILE = "device_topic_map.json"
 MQTT_LOG_FILE = "mqtt_logs.jsonl"
 POSITION_FILE = "last_sent_position.txt"
 
-CHECK_INTERVAL = 5  # seconds
-
-# ================= GLOBAL TRACKER =================
-pending_messages = {}
+CHECK_INTERVAL = 5  # seconds, upper bound on the wait when no new data arrives
+MQTT_CONNECTIONS = int(os.environ.get("MQTT_CONNECTIONS", "4"))  # broker connections, topics are hashed onto them
+MAX_INFLIGHT = 100  # messages waiting for PUBACK per connection before its topics pause
+RECONNECT_MIN_DELAY = 1  # seconds, first reconnect backoff
+RECONNECT_MAX_DELAY = 120  # seconds, backoff cap while the broker stays down
+MAX_PARKED = 10000  # messages queued on one connection (link down or slow) before reading pauses
+
+# device_topic_map.json values are either a topic string or
+# {"topic": "...", "batch_size": 10, "batch_window": 30} for brokers that accept
+# several readings per message; batch_window is the longest a reading waits (seconds)
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_BATCH_WINDOW = 0
+
+# mqtt_logs.jsonl is appended from every connection's threads
+log_lock = threading.Lock()
+log_rotation = LogRotation(MQTT_LOG_FILE)
+# per-IMEI summary and offset index of mqtt_logs.jsonl, read by the dashboard
+log_index = MqttLogIndex(MQTT_LOG_FILE)
 
 # ================= HELPER FUNCTIONS =================
 def load_json(path, default):
@@ -31,51 +55,121 @@ def load_json(path, default):
         return json.load(f)
 
 def save_mqtt_log(entry):
-    with open(MQTT_LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-
-def get_last_position():
-    if not os.path.exists(POSITION_FILE):
-        return 0
-    try:
-        with open(POSITION_FILE, "r") as f:
-            return int(f.read().strip())
-    except:
-        return 0
-
-def save_last_position(pos):
-    with open(POSITION_FILE, "w") as f:
-        f.write(str(pos))
-
-# ================= MQTT CALLBACKS =================
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("✅ MQTT Connected Successfully")
-    else:
-        print("❌ MQTT Connection Failed | RC:", rc)
-
-def on_disconnect(client, userdata, rc):
-    print("⚠ MQTT Disconnected. Reconnecting...")
-    while True:
+    line = dumps_line(entry)
+    with log_lock:
         try:
-            client.reconnect()
-            print("✅ MQTT Reconnected")
-            break
-        except Exception as e:
-            print("⏳ Reconnect failed, retrying...", e)
-            time.sleep(5)
-
-def on_publish(client, userdata, mid):
-    if mid in pending_messages:
-        info = pending_messages.pop(mid)
+            if log_rotation.due(os.path.getsize(MQTT_LOG_FILE)):
+                log_rotation.rotate()
+        except FileNotFoundError:
+            pass
+        with open(MQTT_LOG_FILE, "ab") as f:
+            offset = f.tell()
+            f.write(line)
+            inode = os.fstat(f.fileno()).st_ino
+        log_index.add(entry, inode, offset, len(line))
+
+def save_log_index(force=False):
+    with log_lock:
+        log_index.save(force)
+
+def topic_settings(imei):
+    entry = topic_map.get(imei, imei)
+    if isinstance(entry, dict):
+        return (
+            entry.get("topic", imei),
+            max(1, int(entry.get("batch_size", DEFAULT_BATCH_SIZE))),
+            float(entry.get("batch_window", DEFAULT_BATCH_WINDOW))
+        )
+    return entry, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WINDOW
+
+# ================= PUBLISHER CONNECTION =================
+class PublisherConnection:
+    """One broker connection of the publisher pool.
+
+    Each connection has its own paho client, network loop, publish worker and
+    window of at most max_inflight unacknowledged messages. Messages are
+    handed over with submit(), which never blocks: beyond the window they
+    wait in the connection's queue and are encoded and published on the
+    worker thread, so a slow or disconnected link only holds up the topics
+    hashed onto it while the reader keeps going for the others.
+    """
+
+    def __init__(self, index, outbound, max_inflight):
+        self.name = f"link {index}"
+        self.outbound = outbound
+        self.max_inflight = max_inflight
+
+        # set while the broker has accepted our CONNECT, the worker only publishes while it is set
+        self.link_up = threading.Event()
+        self.cond = threading.Condition()
+        self.inflight = {}        # mid -> message
+        self.early_acks = set()   # PUBACKs that beat publish() returning the mid
+        self.queue = queue.Queue()   # submitted, not yet published, parked while the link is down
+
+        client = mqtt.Client(clean_session=True)
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+
+        client.tls_set(
+            ca_certs=CA_CERT_PATH,
+            cert_reqs=ssl.CERT_NONE,
+            tls_version=ssl.PROTOCOL_TLS
+        )
+        client.tls_insecure_set(True)
+
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_publish = self.on_publish
+        client.max_inflight_messages_set(max_inflight)
+        self.client = client
+
+    def start(self):
+        self.client.connect_async(MQTT_SERVER, MQTT_PORT, 60)
+        threading.Thread(target=self.network_loop, daemon=True).start()
+        threading.Thread(target=self.publish_worker, daemon=True).start()
+
+    def submit(self, message):
+        self.queue.put(message)
+
+    def busy(self):
+        return bool(self.inflight) or not self.queue.empty()
+
+    def saturated(self):
+        return self.queue.qsize() >= MAX_PARKED
+
+    # ---------- MQTT CALLBACKS ----------
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print(f"✅ MQTT Connected Successfully ({self.name})")
+            self.link_up.set()
+        else:
+            print(f"❌ MQTT Connection Failed ({self.name}) | RC:", rc)
+
+    def on_disconnect(self, client, userdata, rc):
+        # reconnecting is left to network_loop(), never block the paho callbacks here
+        if self.link_up.is_set():
+            print(f"⚠ MQTT Disconnected ({self.name}, rc {rc}). Its topics are paused until the link is back")
+        self.link_up.clear()
+
+    def on_publish(self, client, userdata, mid):
+        with self.cond:
+            info = self.inflight.pop(mid, None)
+            if info is None:
+                self.early_acks.add(mid)
+                return
+            self.cond.notify_all()
+        self._delivered(info)
+
+    def _delivered(self, info):
+        self.outbound.done(info["entries"])
 
         print(
             f"✅ UPLOADED | IMEI: {info['imei']} | "
-            f"Time: {info['upload_time']} | Topic: {info['topic']}"
+            f"Time: {info['upload_time']} | Topic: {info['topic']} | "
+            f"Readings: {len(info['entries'])}"
         )
 
         save_mqtt_log({
-            "line": info["line"],
+            "offset": info["offset"],
             "imei": info["imei"],
             "topic": info["topic"],
             "upload_time": info["upload_time"],
@@ -84,119 +178,268 @@ def on_publish(client, userdata, mid):
             "payload": info["payload"]
         })
 
-        save_last_position(info["line"])
+    # ---------- NETWORK LOOP ----------
+    def network_loop(self):
+        """Runs the paho network loop and reconnects with jittered exponential backoff."""
+        delay = RECONNECT_MIN_DELAY
+        failures = 0
+
+        while True:
+            if self.client.loop(timeout=1.0) == mqtt.MQTT_ERR_SUCCESS:
+                if self.link_up.is_set() and (failures or delay > RECONNECT_MIN_DELAY):
+                    if failures:
+                        print(f"✅ MQTT link restored ({self.name}) after {failures} failed attempts")
+                    failures = 0
+                    delay = RECONNECT_MIN_DELAY
+                continue
 
-# ================= MQTT SETUP =================
-client = mqtt.Client(clean_session=True)
-client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+            self.link_up.clear()
+
+            # jitter keeps reconnects from landing in lockstep with the broker's restart
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+            try:
+                self.client.reconnect()
+            except Exception as e:
+                failures += 1
+                if failures == 1:
+                    print(f"⏳ MQTT reconnect failed ({self.name}): {e} (retrying, backoff up to {RECONNECT_MAX_DELAY}s)")
+
+    # ---------- PUBLISH WORKER ----------
+    def publish_worker(self):
+        while True:
+            message = self.queue.get()
+
+            self.link_up.wait()
+            with self.cond:
+                while len(self.inflight) >= self.max_inflight:
+                    self.cond.wait()
+
+            result = self.client.publish(
+                message["topic"],
+                dumps_bytes(message["payload"]),
+                qos=1
+            )
+
+            # NO_CONN: paho keeps the message queued and sends it after reconnect
+            if result.rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                with self.cond:
+                    early = result.mid in self.early_acks
+                    if early:
+                        self.early_acks.discard(result.mid)
+                    else:
+                        self.inflight[result.mid] = message
+                if early:
+                    self._delivered(message)
+                continue
+
+            print(f"❌ PUBLISH FAILED | IMEI: {message['imei']} ({self.name})")
+
+            save_mqtt_log({
+                "offset": message["offset"],
+                "imei": message["imei"],
+                "topic": message["topic"],
+                "upload_time": message["upload_time"],
+                "status": "FAILED",
+                "error": "Publish return code error",
+                "payload": message["payload"]
+            })
+            self.outbound.done(message["entries"])
+
+# ================= PUBLISHER POOL =================
+class PublisherPool:
+    """MQTT_CONNECTIONS broker connections, each topic always uses the same one.
 
-client.tls_set(
-    ca_certs=CA_CERT_PATH,
-    cert_reqs=ssl.CERT_NONE,
-    tls_version=ssl.PROTOCOL_TLS
-)
-client.tls_insecure_set(True)
+    crc32 of the topic picks the connection, so the readings of one topic
+    stay in order on a single link while different topics publish in
+    parallel.
+    """
 
-client.on_connect = on_connect
-client.on_disconnect = on_disconnect
-client.on_publish = on_publish
+    def __init__(self, size, outbound, max_inflight):
+        self.connections = [
+            PublisherConnection(i, outbound, max_inflight) for i in range(max(1, size))
+        ]
 
-client.connect(MQTT_SERVER, MQTT_PORT, 60)
-client.loop_start()
+    def start(self):
+        for connection in self.connections:
+            connection.start()
 
+    def for_topic(self, topic):
+        return self.connections[zlib.crc32(topic.encode()) % len(self.connections)]
+
+    def busy(self):
+        return any(connection.busy() for connection in self.connections)
+
+    def saturated(self):
+        return [connection.name for connection in self.connections if connection.saturated()]
+
+# ================= MQTT SETUP =================
 topic_map = load_json(TOPIC_MAP_FILE, {})
 
-print("🚀 Continuous MQTT Sender Started...")
+# wakes the loop as soon as the decoder appends to DATA_FILE
+watcher = FileWatcher(DATA_FILE)
+
+# reads only records appended after the last acknowledged one
+last_offset, last_inode, replay = get_last_position(POSITION_FILE, DATA_FILE)
+reader = TailReader(DATA_FILE, last_offset, last_inode)
+outbound = OutboundQueue(POSITION_FILE, last_offset, last_inode, replay)
+
+pool = PublisherPool(MQTT_CONNECTIONS, outbound, MAX_INFLIGHT)
+pool.start()
+
+print(f"🚀 Continuous MQTT Sender Started ({len(pool.connections)} broker connections)...")
+print(f"👀 Watching {DATA_FILE} ({watcher.mode})")
+
+# ================= BATCHING =================
+# (topic, imei, day) -> {"entries": [...], "items": [...], "deadline": monotonic seconds}
+open_batches = {}
+
+def measurement(measure, name):
+    # None for a register the decoder could not read as a number (NaN / Infinity)
+    value = measure.get(name, 0)
+    return None if value is None else float(value)
+
+def build_item(record):
+    measure = record.get("decoded_measurements", {})
+
+    actual_flow = measurement(measure, "transient_flow")
+    whole = measurement(measure, "total_cumulative_whole")
+    decimal = measurement(measure, "total_cumulative_decimal")
+    total_flow = None if whole is None or decimal is None else round(whole + decimal, 3)
+
+    return {
+        "subDeviceId": "ttyCOM1_2",
+        "deviceType": "modbus_2",
+        "status": {
+            "ActualFlow": actual_flow,
+            "TotalFlow": total_flow,
+            "InsDiagnostic": "00000000",
+            "timestamp": int(time.time())
+        }
+    }
+
+def add_to_batch(entry, record):
+    imei = record["imei"]
+    item = build_item(record)
+
+    date_epoch = int(
+        datetime.strptime(
+            record["timestamp"], "%Y-%m-%d %H:%M:%S"
+        ).replace(hour=0, minute=0, second=0).timestamp()
+    )
+
+    topic, batch_size, batch_window = topic_settings(imei)
+    key = (topic, imei, date_epoch)
+
+    batch = open_batches.get(key)
+    if batch is None:
+        batch = open_batches[key] = {
+            "entries": [],
+            "items": [],
+            "deadline": time.monotonic() + batch_window
+        }
+    batch["entries"].append(entry)
+    batch["items"].append(item)
+
+    if len(batch["items"]) >= batch_size or batch_window <= 0:
+        publish_batch(key, open_batches.pop(key))
+
+def flush_due_batches():
+    now = time.monotonic()
+    for key in [k for k, b in open_batches.items() if b["deadline"] <= now]:
+        publish_batch(key, open_batches.pop(key))
+
+def next_batch_deadline():
+    if not open_batches:
+        return None
+    return max(0.0, min(b["deadline"] for b in open_batches.values()) - time.monotonic())
+
+def publish_batch(key, batch):
+    topic, imei, date_epoch = key
+
+    mqtt_payload = {
+        "version": "1.0",
+        "onlinetag": imei,
+        "time": date_epoch,
+        "payload": batch["items"]
+    }
+
+    upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    message = {
+        "entries": batch["entries"],
+        "offset": batch["entries"][0]["offset"],
+        "imei": imei,
+        "topic": topic,
+        "upload_time": upload_time,
+        "payload": mqtt_payload
+    }
+
+    # encoding and publishing happen on the connection's worker thread
+    pool.for_topic(topic).submit(message)
 
 # ================= MAIN LOOP =================
+paused = []
+
 while True:
 
     if not os.path.exists(DATA_FILE):
         print("❌ Data file not found:", DATA_FILE)
-        time.sleep(CHECK_INTERVAL)
+        watcher.wait(CHECK_INTERVAL)
         continue
 
-    last_position = get_last_position()
-
-    with open(DATA_FILE, "r", encoding="utf-8") as file:
-        for line_no, line in enumerate(file, start=1):
-
-            if line_no <= last_position:
-                continue
-
-            try:
-                record = json.loads(line.strip())
-
-                imei = record["imei"]
-                measure = record.get("decoded_measurements", {})
-
-                actual_flow = float(measure.get("transient_flow", 0))
-                total_flow = round(
-                    float(measure.get("total_cumulative_whole", 0)) +
-                    float(measure.get("total_cumulative_decimal", 0)),
-                    3
-                )
-
-                date_epoch = int(
-                    datetime.strptime(
-                        record["timestamp"], "%Y-%m-%d %H:%M:%S"
-                    ).replace(hour=0, minute=0, second=0).timestamp()
-                )
-
-                mqtt_payload = {
-                    "version": "1.0",
-                    "onlinetag": imei,
-                    "time": date_epoch,
-                    "payload": [{
-                        "subDeviceId": "ttyCOM1_2",
-                        "deviceType": "modbus_2",
-                        "status": {
-                            "ActualFlow": actual_flow,
-                            "TotalFlow": total_flow,
-                            "InsDiagnostic": "00000000",
-                            "timestamp": int(time.time())
-                        }
-                    }]
-                }
-
-                topic = topic_map.get(imei, imei)
-                upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                result = client.publish(
-                    topic,
-                    json.dumps(mqtt_payload),
-                    qos=1
-                )
-
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    pending_messages[result.mid] = {
-                        "line": line_no,
-                        "imei": imei,
-                        "topic": topic,
-                        "upload_time": upload_time,
-                        "payload": mqtt_payload
-                    }
-                else:
-                    print(f"❌ PUBLISH FAILED | IMEI: {imei}")
-
-                    save_mqtt_log({
-                        "line": line_no,
-                        "imei": imei,
-                        "topic": topic,
-                        "upload_time": upload_time,
-                        "status": "FAILED",
-                        "error": "Publish return code error",
-                        "payload": mqtt_payload
-                    })
-
-            except Exception as e:
-                print(f"❌ ERROR Line {line_no}: {e}")
+    # memory stays bounded: reading waits only once a link has MAX_PARKED messages queued
+    saturated = pool.saturated()
+    if saturated and not paused:
+        print(f"⏸ Reading paused, {MAX_PARKED} messages queued on {', '.join(saturated)} until it catches up")
+    paused = saturated
+    lines = [] if saturated else reader.read_lines(MAX_INFLIGHT)
+
+    for offset, line in lines:
+        entry = {
+            "offset": offset,
+            "next_offset": offset + len(line),
+            "inode": reader.inode,
+            "imei": None
+        }
+        try:
+            record = decode_reading(line)
+            imei = record.get("imei")
+            entry["imei"] = imei if isinstance(imei, str) else None
+        except (ValueError, AttributeError) as e:
+            record, decode_error = None, e
+        outbound.track(entry)
+
+        if outbound.replayed(entry):
+            # read again after a restart, delivered before it
+            outbound.done([entry])
+            continue
 
-                save_mqtt_log({
-                    "line": line_no,
-                    "status": "ERROR",
-                    "error": str(e),
-                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
+        try:
+            if record is None:
+                raise decode_error
+            add_to_batch(entry, record)
 
-    time.sleep(CHECK_INTERVAL)
+        except Exception as e:
+            print(f"❌ ERROR at byte {offset}: {e}")
+
+            save_mqtt_log({
+                "offset": offset,
+                "status": "ERROR",
+                "error": str(e),
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+            outbound.done([entry])
+
+    flush_due_batches()
+    outbound.save_checkpoint(force=not lines)
+    save_log_index(force=not lines)
+
+    if not lines:
+        # come back soon while acks are still due so the last ones get checkpointed
+        busy = outbound.dirty or log_index.dirty or outbound.pending() or pool.busy()
+        timeout = CHECKPOINT_INTERVAL if busy else CHECK_INTERVAL
+        batch_due = next_batch_deadline()
+        if batch_due is not None:
+            timeout = min(timeout, batch_due)
+        watcher.wait(timeout)
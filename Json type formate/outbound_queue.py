@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# ================= CONFIG =================
+DATA_FILE = "decord_result.jsonl"
+POSITION_FILE = "last_sent_position.txt"
+CHECKPOINT_INTERVAL = 1  # seconds between position file writes while acks arrive
+
+# ================= POSITION FILE =================
+def line_to_offset(path, line_count):
+    offset = 0
+    if not os.path.exists(path):
+        return offset
+    with open(path, "rb") as f:
+        for _ in range(line_count):
+            line = f.readline()
+            if not line:
+                break
+            offset += len(line)
+    return offset
+
+def get_last_position(path=POSITION_FILE, data_file=DATA_FILE):
+    # {"offset": <byte offset of the oldest unacked record>, "inode": <DATA_FILE inode>,
+    #  "read": {"offset", "inode"} of the end of the last record read, "inodes": [files from
+    #  "inode" to "read" in order], "pending": {imei: {"offset", "inode"} of its oldest unacked record}}
+    # the last three only while records are unacked, returned as the replay state (or None)
+    if not os.path.exists(path):
+        return 0, None, None
+    try:
+        with open(path, "r") as f:
+            content = f.read().strip()
+        if content.isdigit():
+            # old format: number of lines already sent
+            return line_to_offset(data_file, int(content)), None, None
+        position = json.loads(content)
+        offset, inode = int(position.get("offset", 0)), position.get("inode")
+    except (ValueError, AttributeError, OSError):
+        return 0, None, None
+
+    try:
+        replay = {
+            "read": (int(position["read"]["offset"]), position["read"]["inode"]),
+            "inodes": list(position["inodes"]),
+            "pending": {
+                imei: (int(p["offset"]), p["inode"]) for imei, p in position.get("pending", {}).items()
+            }
+        }
+    except (KeyError, TypeError, ValueError, AttributeError):
+        replay = None   # saved while nothing was in flight, or by an older version
+    return offset, inode, replay
+
+def save_last_position(offset, inode, replay=None, path=POSITION_FILE):
+    position = {"offset": offset, "inode": inode}
+    if replay:
+        position.update(replay)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(position, f)
+    os.replace(tmp_path, path)
+
+# ================= OUTBOUND QUEUE =================
+class OutboundQueue:
+    """Records between read and PUBACK, kept per IMEI in file order.
+
+    Every record is tracked as soon as it is read, whichever connection ends
+    up publishing it. The checkpoint is the oldest unacknowledged record, so
+    a PUBACK on a fast connection never skips an unacked record on a slow
+    one. Next to it the position file keeps how far the reader got and the
+    oldest unacked record of every IMEI still waiting: after a restart the
+    records in between are read again but only the ones from those points
+    on are published again (replayed() is True for the rest), so a link
+    that was stuck does not make the other topics resend what they had
+    delivered.
+    """
+
+    def __init__(self, path, offset, inode, replay=None, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.waiting = {}         # imei -> deque of its unacked records, in file order
+        self.count = 0            # records tracked so far, orders the heads of waiting
+        self.read_position = (offset, inode)
+        self.inodes = [inode]     # files read from the checkpoint's on, in order
+        self.replay = replay      # state saved by the previous run, until the reader passes its "read"
+        self.dirty = False
+        self.last_save = 0.0
+
+    def track(self, entry):
+        entry["acked"] = False
+        with self.lock:
+            self.count += 1
+            entry["seq"] = self.count
+            self.waiting.setdefault(entry["imei"], deque()).append(entry)
+            self.read_position = (entry["next_offset"], entry["inode"])
+            if entry["inode"] != self.inodes[-1]:
+                self.inodes.append(entry["inode"])
+            self.dirty = True
+
+    def done(self, entries):
+        # acknowledged, or never going to be published (bad line, rejected publish, replayed)
+        with self.lock:
+            for entry in entries:
+                entry["acked"] = True
+                waiting = self.waiting.get(entry["imei"])
+                while waiting and waiting[0]["acked"]:
+                    waiting.popleft()
+                if waiting is not None and not waiting:
+                    del self.waiting[entry["imei"]]
+            self.dirty = True
+
+    def replayed(self, entry):
+        """True for a record read again after a restart that was already delivered (or logged)."""
+        replay = self.replay
+        if replay is None:
+            return False
+        read_offset, read_inode = replay["read"]
+        inodes = replay["inodes"]
+        if entry["inode"] not in inodes or (entry["inode"] == read_inode and entry["offset"] >= read_offset):
+            self.replay = None   # past where the previous run had read to
+            return False
+        if (entry["next_offset"], entry["inode"]) == replay["read"]:
+            self.replay = None   # the last record it had read
+
+        first = replay["pending"].get(entry["imei"])
+        if first is None:
+            return True
+        if first[1] not in inodes:
+            return False
+        return (inodes.index(entry["inode"]), entry["offset"]) < (inodes.index(first[1]), first[0])
+
+    def pending(self):
+        return bool(self.waiting)
+
+    def save_checkpoint(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not self.dirty or (not force and now - self.last_save < self.interval):
+                return
+            if self.replay is not None:
+                return   # the saved state still describes the records being read again
+
+            heads = [waiting[0] for waiting in self.waiting.values()]
+            replay = None
+            if heads:
+                first = min(heads, key=lambda entry: entry["seq"])
+                offset, inode = first["offset"], first["inode"]
+                if inode in self.inodes:
+                    del self.inodes[:self.inodes.index(inode)]
+                read_offset, read_inode = self.read_position
+                replay = {
+                    "read": {"offset": read_offset, "inode": read_inode},
+                    "inodes": list(self.inodes),
+                    "pending": {
+                        entry["imei"]: {"offset": entry["offset"], "inode": entry["inode"]}
+                        for entry in heads if entry["imei"] is not None
+                    }
+                }
+            else:
+                offset, inode = self.read_position
+                self.inodes = [inode]
+
+            self.dirty = False
+            self.last_save = now
+            save_last_position(offset, inode, replay, self.path)
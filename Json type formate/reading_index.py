@@ -0,0 +1,387 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+
+from file_watch import TailReader
+from log_rotation import load_segments, find_segment, open_segment, manifest_path
+from json_codec import decode_reading
+
+# ================= POSITIONS =================
+# Index entries are (file number << OFFSET_BITS) | byte offset. Files are numbered in
+# the order they are read (rotated segments oldest first, then the live file), so
+# positions sort in file order across rotations.
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+READ_CHUNK = 1000   # positions read per pass, sorted per file so a gzipped segment only seeks forward
+
+# ================= TIME KEYS =================
+def time_key(timestamp, fill="0"):
+    """"YYYY-MM-DD HH:MM:SS" (or a prefix like "YYYY-MM-DDTHH:MM") as a sortable int.
+
+    Missing trailing digits are padded with fill, "9" makes an inclusive upper bound.
+    """
+    digits = "".join(c for c in str(timestamp) if c.isdigit())[:14]
+    return int(digits.ljust(14, fill))
+
+@lru_cache(maxsize=4096)
+def _day_start(day):
+    return datetime.strptime(str(day), "%Y%m%d").timestamp()
+
+def key_seconds(key):
+    """Epoch seconds (local time) of a time_key, without a strptime per reading."""
+    day, clock = divmod(key, 1000000)
+    hours, rest = divmod(clock, 10000)
+    minutes, seconds = divmod(rest, 100)
+    return _day_start(day) + hours * 3600 + minutes * 60 + seconds
+
+def make_cursor(key, offset):
+    return f"{key}:{offset}"
+
+def parse_cursor(cursor):
+    key, offset = cursor.split(":")
+    return int(key), int(offset)
+
+def make_since(inode, offset):
+    return f"{inode or 0}:{offset}"
+
+def parse_since(since):
+    """"inode:offset" position in the data file, ValueError if malformed."""
+    inode, offset = since.split(":")
+    return int(inode), int(offset)
+
+# ================= READING INDEX =================
+class ReadingIndex:
+    """Latest reading and a time-ordered position index per IMEI for decord_result.jsonl.
+
+    Only the bytes appended since the previous refresh are parsed, so after
+    the first request a lookup costs a stat() plus the new lines. Readings
+    are compared by timestamp, a later line with the same timestamp wins.
+    Rotated segments (log_rotation.py) are indexed like the live file and
+    read back through open_segment(), so ranges and pages reach across
+    rotations. Positions are dropped for a file that was truncated or
+    replaced and for segments removed by retention, the latest reading per
+    IMEI is kept.
+
+    A "since" position (inode:offset of the end of the indexed data) lets a
+    poller ask only for what was appended after its previous request, and
+    listeners are called with every batch of newly indexed records.
+    """
+
+    def __init__(self, path, batch_lines=5000):
+        self.path = path
+        self.batch_lines = batch_lines
+        segments = load_segments(path)
+        self.reader = TailReader(path, 0, segments[0]["inode"] if segments else None)
+        self.lock = threading.Lock()
+        self.latest_by_imei = {}    # imei -> newest record
+        self.keys_by_imei = {}      # imei -> sorted time keys
+        self.offsets_by_imei = {}   # imei -> positions, same order as the keys
+        self.arrivals_by_imei = {}  # imei -> positions in file order
+        self.latest_offset = {}     # imei -> position of the newest record
+        self.files = []             # file number -> inode
+        self.file_numbers = {}      # inode -> file number, for the files still indexed
+        self.indexed_inode = None
+        self.indexed_end = 0
+        self.manifest_mtime = None
+        self.listeners = []         # called with each list of new records, outside the lock
+
+    def refresh(self):
+        while True:
+            new_records = []
+            with self.lock:
+                self._check_segments()
+                lines = self.reader.read_lines(self.batch_lines)
+                if not lines:
+                    break
+
+                if self.reader.inode != self.indexed_inode or lines[0][0] < self.indexed_end:
+                    self._next_file(self.reader.inode)
+
+                base = self.file_numbers[self.indexed_inode] << OFFSET_BITS
+                for offset, line in lines:
+                    record = self._index_line(base | offset, line)
+                    if record is not None and self.listeners:
+                        new_records.append(record)
+
+                offset, line = lines[-1]
+                self.indexed_end = offset + len(line)
+
+            # per batch, so the first pass over a long history is never held in memory
+            if new_records:
+                for listener in self.listeners:
+                    listener(new_records)
+
+    def _next_file(self, inode):
+        # caller holds self.lock: the reader moved on to another file, or the live one was truncated
+        listed = {entry["inode"] for entry in load_segments(self.path)}
+        self._drop_files({
+            number for known, number in self.file_numbers.items()
+            if known == inode or known not in listed
+        })
+        self.file_numbers[inode] = len(self.files)
+        self.files.append(inode)
+        self.indexed_inode = inode
+        self.indexed_end = 0
+
+    def _check_segments(self):
+        # caller holds self.lock: a manifest change may be retention removing segments
+        try:
+            mtime = os.stat(manifest_path(self.path)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.manifest_mtime:
+            return
+        self.manifest_mtime = mtime
+        listed = {entry["inode"] for entry in load_segments(self.path)}
+        self._drop_files({
+            number for known, number in self.file_numbers.items()
+            if known not in listed and known != self.indexed_inode
+        })
+
+    def _drop_files(self, gone):
+        # caller holds self.lock: truncated, replaced or removed files, their positions point nowhere
+        if not gone:
+            return
+        for known in [known for known, number in self.file_numbers.items() if number in gone]:
+            del self.file_numbers[known]
+        for imei in list(self.keys_by_imei):
+            keep = [i for i, p in enumerate(self.offsets_by_imei[imei]) if p >> OFFSET_BITS not in gone]
+            self.keys_by_imei[imei] = array("q", (self.keys_by_imei[imei][i] for i in keep))
+            self.offsets_by_imei[imei] = array("q", (self.offsets_by_imei[imei][i] for i in keep))
+            self.arrivals_by_imei[imei] = array(
+                "q", (p for p in self.arrivals_by_imei[imei] if p >> OFFSET_BITS not in gone)
+            )
+        for imei in [imei for imei, p in self.latest_offset.items() if p >> OFFSET_BITS in gone]:
+            del self.latest_offset[imei]
+
+    def _index_line(self, offset, line):
+        try:
+            record = decode_reading(line)
+            imei = record["imei"]
+            timestamp = record["timestamp"]
+            key = time_key(timestamp)
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        last = self.latest_by_imei.get(imei)
+        if last is None or timestamp >= last["timestamp"]:
+            self.latest_by_imei[imei] = record
+            self.latest_offset[imei] = offset
+
+        keys = self.keys_by_imei.get(imei)
+        if keys is None:
+            keys = self.keys_by_imei[imei] = array("q")
+            self.offsets_by_imei[imei] = array("q")
+            self.arrivals_by_imei[imei] = array("q")
+        offsets = self.offsets_by_imei[imei]
+        self.arrivals_by_imei[imei].append(offset)
+
+        if not keys or key >= keys[-1]:
+            keys.append(key)
+            offsets.append(offset)
+        else:
+            # late reading, equal keys stay in file order
+            i = bisect_right(keys, key)
+            keys.insert(i, key)
+            offsets.insert(i, offset)
+
+        return record
+
+    def _open(self, inode):
+        # the live file or the rotated segment that had this inode, None if it is gone
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            if os.fstat(f.fileno()).st_ino == inode:
+                return f
+            f.close()
+        found = find_segment(self.path, inode)
+        if found is None:
+            return None
+        try:
+            return open_segment(self.path, found[1])
+        except FileNotFoundError:
+            return None
+
+    def _iter_at(self, positions):
+        # READ_CHUNK positions at a time, each file opened once per chunk and read in offset order
+        files = self.files
+        for start in range(0, len(positions), READ_CHUNK):
+            chunk = positions[start:start + READ_CHUNK]
+            records = {}
+            for number, group in groupby(sorted(chunk), key=lambda p: p >> OFFSET_BITS):
+                f = self._open(files[number])
+                if f is None:
+                    continue  # removed by retention since the last refresh
+                with f:
+                    for position in group:
+                        f.seek(position & OFFSET_MASK)
+                        try:
+                            records[position] = decode_reading(f.readline())
+                        except ValueError:
+                            pass
+            for position in chunk:
+                if position in records:
+                    yield records[position]
+
+    def _read_at(self, positions):
+        return list(self._iter_at(positions))
+
+    def _position(self, inode, offset):
+        # caller holds self.lock, the index position of a "since", None when it is stale
+        if not inode and not offset:
+            return 0
+        number = self.file_numbers.get(inode)
+        if number is None or (inode == self.indexed_inode and offset > self.indexed_end):
+            return None
+        return number << OFFSET_BITS | offset
+
+    def _since(self, position):
+        # caller holds self.lock
+        return make_since(self.files[position >> OFFSET_BITS], position & OFFSET_MASK)
+
+    def _range(self, keys, start, end):
+        lo = bisect_left(keys, time_key(start)) if start else 0
+        hi = bisect_right(keys, time_key(end, "9")) if end else len(keys)
+        return lo, hi
+
+    # ---------- LOOKUP ----------
+    def latest(self):
+        """imei -> newest record, in order of first appearance in the file."""
+        self.refresh()
+        with self.lock:
+            return dict(self.latest_by_imei)
+
+    def changed_since(self, since):
+        """(imei -> newest record for IMEIs with a newer reading, next since).
+
+        since=None returns every IMEI. The dict is None when the cursor is
+        stale (its file was truncated, replaced or removed by retention),
+        the caller should start over.
+        """
+        inode, offset = parse_since(since) if since else (None, 0)
+        self.refresh()
+
+        with self.lock:
+            next_since = make_since(self.indexed_inode, self.indexed_end)
+            if not since:
+                return dict(self.latest_by_imei), next_since
+            position = self._position(inode, offset)
+            if position is None:
+                return None, next_since
+            changed = {
+                imei: self.latest_by_imei[imei]
+                for imei, at in self.latest_offset.items() if at >= position
+            }
+        return changed, next_since
+
+    def last_seen(self):
+        return {imei: r["timestamp"] for imei, r in self.latest().items()}
+
+    def imeis(self):
+        return list(self.latest())
+
+    def readings(self, imei, start=None, end=None, limit=500, cursor=None):
+        """Records of one IMEI between start and end (inclusive), oldest first.
+
+        Returns (records, next_cursor, has_more, since). Pass next_cursor back
+        to get the following page, since to poll for readings appended later.
+        Without start or cursor the newest limit records of the range are
+        returned. Raises ValueError for a malformed cursor.
+        """
+        after = parse_cursor(cursor) if cursor else None
+        self.refresh()
+
+        with self.lock:
+            since = make_since(self.indexed_inode, self.indexed_end)
+            keys = self.keys_by_imei.get(imei)
+            if not keys:
+                return [], cursor, False, since
+            offsets = self.offsets_by_imei[imei]
+
+            lo, hi = self._range(keys, start, end)
+
+            if after is not None:
+                i = bisect_left(keys, after[0])
+                while i < len(keys) and keys[i] == after[0] and offsets[i] <= after[1]:
+                    i += 1
+                lo = max(lo, i)
+
+            if start is None and after is None:
+                first, stop = max(lo, hi - limit), hi
+            else:
+                first, stop = lo, min(hi, lo + limit)
+
+            if stop <= first:
+                return [], cursor, False, since
+
+            positions = offsets[first:stop]
+            next_cursor = make_cursor(keys[stop - 1], offsets[stop - 1])
+            has_more = stop < hi
+            records = self._read_at(positions)
+
+        return records, next_cursor, has_more, since
+
+    def readings_since(self, imei, since, start=None, end=None, limit=500):
+        """Records of one IMEI appended after since, in file order.
+
+        Returns (records, next_since, has_more), records is None when the
+        cursor is stale. start / end filter by timestamp like readings().
+        """
+        inode, offset = parse_since(since)
+        self.refresh()
+
+        with self.lock:
+            position = self._position(inode, offset)
+            if position is None:
+                return None, make_since(self.indexed_inode, self.indexed_end), False
+
+            arrivals = self.arrivals_by_imei.get(imei, ())
+            first = bisect_left(arrivals, position)
+            stop = min(len(arrivals), first + limit)
+            has_more = stop < len(arrivals)
+            if has_more:
+                next_since = self._since(arrivals[stop])
+            else:
+                next_since = make_since(self.indexed_inode, self.indexed_end)
+            records = self._read_at(arrivals[first:stop])
+
+        lo = time_key(start) if start else None
+        hi = time_key(end, "9") if end else None
+        records = [
+            r for r in records
+            if (lo is None or time_key(r["timestamp"]) >= lo)
+            and (hi is None or time_key(r["timestamp"]) <= hi)
+        ]
+        return records, next_since, has_more
+
+    def scan(self, imei, start=None, end=None):
+        """Every reading of one IMEI between start and end, oldest first.
+
+        Returns a dict with count, first_key / last_key (time keys of the
+        range, None when empty), since and records. records is a generator
+        that reads the file lazily, so any range streams in constant memory.
+        """
+        self.refresh()
+
+        with self.lock:
+            since = make_since(self.indexed_inode, self.indexed_end)
+            keys = self.keys_by_imei.get(imei)
+            lo, hi = self._range(keys, start, end) if keys else (0, 0)
+            positions = self.offsets_by_imei[imei][lo:hi] if hi > lo else array("q")
+            first_key = keys[lo] if positions else None
+            last_key = keys[hi - 1] if positions else None
+
+        return {
+            "count": len(positions),
+            "first_key": first_key,
+            "last_key": last_key,
+            "since": since,
+            "records": self._iter_at(positions)
+        }
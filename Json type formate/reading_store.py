@@ -0,0 +1,331 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from reading_index import time_key, make_cursor, parse_cursor, make_since, parse_since
+from log_rotation import iter_lines
+from json_codec import dumps, decode_reading
+
+# ================= CONFIG =================
+READINGS_DB = "readings.db"
+IMPORT_BATCH = 5000   # JSONL lines per transaction in import_jsonl()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    imei TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    ts_key INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_imei_time ON readings (imei, ts_key, id);
+"""
+
+def _row(record):
+    # (imei, timestamp, ts_key, record json), None for records without imei / timestamp
+    try:
+        imei = record["imei"]
+        timestamp = record["timestamp"]
+        return imei, timestamp, time_key(timestamp), dumps(record)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# ================= READING STORE =================
+class ReadingStore:
+    """Decoded readings in an embedded SQLite database (WAL mode).
+
+    The decoder inserts, the dashboard reads: WAL lets readers run while a
+    write is in progress, and the (imei, ts_key, id) index turns a per-IMEI
+    time range into an index range scan. Every thread gets its own
+    connection. records() and by_imei() return the same shapes as
+    load_jsonl() and group_by_imei() in app.py.
+    """
+
+    def __init__(self, path=READINGS_DB):
+        self.path = path
+        self.local = threading.local()
+
+        conn = self.connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    # ---------- WRITE ----------
+    def insert(self, records):
+        """Insert decoded records in one transaction, returns how many were stored."""
+        rows = [row for row in map(_row, records) if row is not None]
+        if rows:
+            conn = self.connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO readings (imei, timestamp, ts_key, record) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        return len(rows)
+
+    def import_jsonl(self, path, batch=IMPORT_BATCH):
+        """One-shot load of an existing decord_result.jsonl and its rotated segments, returns the number of readings."""
+        total = 0
+        lines = iter_lines(path)
+        while True:
+            records = []
+            for line in lines:
+                if line.strip():
+                    try:
+                        records.append(decode_reading(line))
+                    except ValueError:
+                        continue
+                if len(records) >= batch:
+                    break
+            if not records:
+                break
+            total += self.insert(records)
+        return total
+
+    # ---------- READ ----------
+    def count(self):
+        return self.connect().execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+    def last_id(self):
+        return self.connect().execute("SELECT COALESCE(MAX(id), 0) FROM readings").fetchone()[0]
+
+    def records(self, imei=None):
+        """Every reading (of one IMEI) in insertion order, like load_jsonl(DATA_FILE)."""
+        conn = self.connect()
+        if imei is None:
+            rows = conn.execute("SELECT record FROM readings ORDER BY id")
+        else:
+            rows = conn.execute("SELECT record FROM readings WHERE imei = ? ORDER BY id", (imei,))
+        return [decode_reading(r) for r, in rows]
+
+    def by_imei(self):
+        """imei -> readings sorted by timestamp, like group_by_imei(load_jsonl(DATA_FILE))."""
+        result = {}
+        rows = self.connect().execute("SELECT imei, record FROM readings ORDER BY imei, ts_key, id")
+        for imei, record in rows:
+            result.setdefault(imei, []).append(decode_reading(record))
+        return result
+
+# ================= STORE INDEX =================
+class StoreIndex:
+    """ReadingIndex interface on top of a ReadingStore, for app.py.
+
+    Cursors are "ts_key:id" and since positions "0:id" (the first id not
+    seen yet), so the API and templates work unchanged. refresh() reads the
+    rows inserted since the previous call to keep the latest reading per
+    IMEI and to feed the listeners (rollups, live feed). Everything else is
+    answered by indexed queries.
+    """
+
+    def __init__(self, store, batch_lines=5000):
+        self.store = store
+        self.batch_lines = batch_lines
+        self.lock = threading.Lock()
+        self.latest_by_imei = {}    # imei -> newest record
+        self.latest_id = {}         # imei -> id of the newest record
+        self.next_id = 1            # first id refresh() has not read yet
+        self.listeners = []         # called with each list of new records, outside the lock
+
+    def refresh(self):
+        conn = self.store.connect()
+        while True:
+            new_records = []
+            with self.lock:
+                if self.next_id > 1 and self.store.last_id() < self.next_id - 1:
+                    # the database was replaced, start over
+                    self.latest_by_imei.clear()
+                    self.latest_id.clear()
+                    self.next_id = 1
+
+                rows = conn.execute(
+                    "SELECT id, timestamp, record FROM readings WHERE id >= ? ORDER BY id LIMIT ?",
+                    (self.next_id, self.batch_lines)
+                ).fetchall()
+                if not rows:
+                    break
+
+                for row_id, timestamp, text in rows:
+                    record = decode_reading(text)
+                    imei = record["imei"]
+                    last = self.latest_by_imei.get(imei)
+                    if last is None or timestamp >= last["timestamp"]:
+                        self.latest_by_imei[imei] = record
+                        self.latest_id[imei] = row_id
+                    if self.listeners:
+                        new_records.append(record)
+
+                self.next_id = rows[-1][0] + 1
+
+            if new_records:
+                for listener in self.listeners:
+                    listener(new_records)
+
+    def _since(self):
+        # caller holds self.lock
+        return make_since(0, self.next_id)
+
+    def _stale(self, inode, offset):
+        # caller holds self.lock
+        return inode != 0 or offset > self.next_id
+
+    def _bounds(self, start, end):
+        lo = time_key(start) if start else 0
+        hi = time_key(end, "9") if end else 99999999999999
+        return lo, hi
+
+    # ---------- LOOKUP ----------
+    def latest(self):
+        """imei -> newest record, in order of first appearance."""
+        self.refresh()
+        with self.lock:
+            return dict(self.latest_by_imei)
+
+    def changed_since(self, since):
+        """(imei -> newest record for IMEIs with a newer reading, next since), see ReadingIndex."""
+        inode, offset = parse_since(since) if since else (None, 0)
+        self.refresh()
+
+        with self.lock:
+            position = self._since()
+            if not since:
+                return dict(self.latest_by_imei), position
+            if self._stale(inode, offset):
+                return None, position
+            changed = {
+                imei: self.latest_by_imei[imei]
+                for imei, at in self.latest_id.items() if at >= offset
+            }
+        return changed, position
+
+    def last_seen(self):
+        return {imei: r["timestamp"] for imei, r in self.latest().items()}
+
+    def imeis(self):
+        return list(self.latest())
+
+    def readings(self, imei, start=None, end=None, limit=500, cursor=None):
+        """(records, next_cursor, has_more, since) for one IMEI, see ReadingIndex.readings()."""
+        after = parse_cursor(cursor) if cursor else None
+        self.refresh()
+        lo, hi = self._bounds(start, end)
+
+        with self.lock:
+            since = self._since()
+            last = self.next_id - 1
+
+        conn = self.store.connect()
+        if start is None and after is None:
+            rows = conn.execute(
+                "SELECT ts_key, id, record FROM readings"
+                " WHERE imei = ? AND ts_key BETWEEN ? AND ? AND id <= ?"
+                " ORDER BY ts_key DESC, id DESC LIMIT ?",
+                (imei, lo, hi, last, limit)
+            ).fetchall()
+            rows.reverse()
+            has_more = False
+        else:
+            after_key, after_id = after if after is not None else (lo, 0)
+            rows = conn.execute(
+                "SELECT ts_key, id, record FROM readings"
+                " WHERE imei = ? AND ts_key BETWEEN ? AND ? AND id <= ?"
+                " AND (ts_key, id) > (?, ?)"
+                " ORDER BY ts_key, id LIMIT ?",
+                (imei, lo, hi, last, after_key, after_id, limit + 1)
+            ).fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+
+        if not rows:
+            return [], cursor, False, since
+        next_cursor = make_cursor(rows[-1][0], rows[-1][1])
+        return [decode_reading(r[2]) for r in rows], next_cursor, has_more, since
+
+    def readings_since(self, imei, since, start=None, end=None, limit=500):
+        """(records, next_since, has_more) appended after since, see ReadingIndex.readings_since()."""
+        inode, offset = parse_since(since)
+        self.refresh()
+        lo, hi = self._bounds(start, end)
+
+        with self.lock:
+            if self._stale(inode, offset):
+                return None, self._since(), False
+            position = self._since()
+            last = self.next_id - 1
+
+        # +imei keeps the planner on the rowid range, only the new rows are visited
+        rows = self.store.connect().execute(
+            "SELECT id, record FROM readings"
+            " WHERE id BETWEEN ? AND ? AND +imei = ? AND ts_key BETWEEN ? AND ?"
+            " ORDER BY id LIMIT ?",
+            (offset, last, imei, lo, hi, limit + 1)
+        ).fetchall()
+        has_more = len(rows) > limit
+        if has_more:
+            position = make_since(0, rows[limit][0])
+            rows = rows[:limit]
+        return [decode_reading(r[1]) for r in rows], position, has_more
+
+    def scan(self, imei, start=None, end=None):
+        """Every reading of one IMEI between start and end, see ReadingIndex.scan()."""
+        self.refresh()
+        lo, hi = self._bounds(start, end)
+
+        with self.lock:
+            since = self._since()
+            last = self.next_id - 1
+
+        count, first_key, last_key = self.store.connect().execute(
+            "SELECT COUNT(*), MIN(ts_key), MAX(ts_key) FROM readings"
+            " WHERE imei = ? AND ts_key BETWEEN ? AND ? AND id <= ?",
+            (imei, lo, hi, last)
+        ).fetchone()
+
+        def records():
+            rows = self.store.connect().execute(
+                "SELECT record FROM readings"
+                " WHERE imei = ? AND ts_key BETWEEN ? AND ? AND id <= ?"
+                " ORDER BY ts_key, id",
+                (imei, lo, hi, last)
+            )
+            for text, in rows:
+                yield decode_reading(text)
+
+        return {
+            "count": count,
+            "first_key": first_key,
+            "last_key": last_key,
+            "since": since,
+            "records": records()
+        }
+
+# ================= IMPORT TOOL =================
+if __name__ == "__main__":
+    # python reading_store.py import [decord_result.jsonl] [readings.db]
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: python reading_store.py import [jsonl] [db]")
+        sys.exit(1)
+
+    source = sys.argv[2] if len(sys.argv) > 2 else "decord_result.jsonl"
+    target = sys.argv[3] if len(sys.argv) > 3 else READINGS_DB
+    if not os.path.exists(source):
+        print(f"❌ File not found: {source}")
+        sys.exit(1)
+
+    store = ReadingStore(target)
+    existing = store.count()
+    if existing:
+        print(f"❌ {target} already holds {existing} readings, import into an empty database")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    total = store.import_jsonl(source)
+    print(f"✅ Imported {total} readings from {source} into {target} in {time.perf_counter() - started:.1f}s")
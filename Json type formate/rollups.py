@@ -0,0 +1,198 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from reading_index import time_key
+
+# ================= PERIODS =================
+# time_key // divisor is the bucket key: YYYYMMDDHH for hours, YYYYMMDD for days
+PERIODS = {
+    "hour": 10000,
+    "day": 1000000
+}
+
+def period_label(period, key):
+    text = str(key)
+    if period == "hour":
+        return f"{text[0:4]}-{text[4:6]}-{text[6:8]} {text[8:10]}:00"
+    return f"{text[0:4]}-{text[4:6]}-{text[6:8]}"
+
+# bucket slots
+COUNT, FLOW_MIN, FLOW_MAX, FLOW_SUM, FIRST_KEY, FIRST_TOTAL, FIRST_NEGATIVE, LAST_KEY, LAST_TOTAL, LAST_NEGATIVE = range(10)
+
+# ================= ROLLUPS =================
+class Rollups:
+    """Hourly and daily consumption aggregates per IMEI, maintained incrementally.
+
+    Feed it the records ReadingIndex indexes (add() is a ReadingIndex
+    listener). Each bucket keeps the reading count, min / max / sum of the
+    transient flow and the first and last positive / negative totals, so
+    volume and reverse flow per bucket are differences of the meter totals,
+    including what flowed between the last reading of the previous bucket
+    and the first one of this bucket. Hourly buckets older than hourly_days
+    are dropped, daily buckets are kept.
+    """
+
+    def __init__(self, values, hourly_days=62, prune_interval=600):
+        self.values = values          # record -> (flow, positive, negative, sampling) or None
+        self.hourly_days = hourly_days
+        self.prune_interval = prune_interval
+
+        self.lock = threading.Lock()
+        self.buckets = {period: {} for period in PERIODS}   # period -> imei -> key -> bucket
+        self.next_prune = 0.0
+
+    def _hour_cutoff(self):
+        oldest = datetime.now() - timedelta(days=self.hourly_days)
+        return int(oldest.strftime("%Y%m%d%H"))
+
+    # ---------- UPDATE ----------
+    def add(self, records):
+        hour_cutoff = self._hour_cutoff()
+
+        with self.lock:
+            for record in records:
+                values = self.values(record)
+                if values is None:
+                    continue
+                flow, positive, negative, _ = values
+                try:
+                    key = time_key(record["timestamp"])
+                except KeyError:
+                    continue
+
+                for period, divisor in PERIODS.items():
+                    bucket_key = key // divisor
+                    if period == "hour" and bucket_key < hour_cutoff:
+                        continue
+                    by_key = self.buckets[period].setdefault(record["imei"], {})
+                    bucket = by_key.get(bucket_key)
+                    if bucket is None:
+                        by_key[bucket_key] = [
+                            1, flow, flow, flow,
+                            key, positive, negative,
+                            key, positive, negative
+                        ]
+                        continue
+
+                    bucket[COUNT] += 1
+                    bucket[FLOW_MIN] = min(bucket[FLOW_MIN], flow)
+                    bucket[FLOW_MAX] = max(bucket[FLOW_MAX], flow)
+                    bucket[FLOW_SUM] += flow
+                    if key < bucket[FIRST_KEY]:
+                        bucket[FIRST_KEY:LAST_KEY] = [key, positive, negative]
+                    if key >= bucket[LAST_KEY]:
+                        bucket[LAST_KEY:] = [key, positive, negative]
+
+            if time.monotonic() >= self.next_prune:
+                self._prune_hours(hour_cutoff)
+                self.next_prune = time.monotonic() + self.prune_interval
+
+    def _prune_hours(self, cutoff):
+        # caller holds self.lock
+        for by_key in self.buckets["hour"].values():
+            for bucket_key in [k for k in by_key if k < cutoff]:
+                del by_key[bucket_key]
+
+    # ---------- QUERIES ----------
+    def _range(self, period, start, end):
+        divisor = PERIODS[period]
+        lo = time_key(start) // divisor if start else None
+        hi = time_key(end, "9") // divisor if end else None
+        return lo, hi
+
+    def _rows(self, by_key, lo, hi):
+        # caller holds self.lock, yields (key, bucket, volume, reverse) oldest first
+        keys = sorted(by_key)
+        first = bisect_left(keys, lo) if lo is not None else 0
+        stop = bisect_right(keys, hi) if hi is not None else len(keys)
+
+        previous = by_key[keys[first - 1]] if first > 0 else None
+        for key in keys[first:stop]:
+            bucket = by_key[key]
+            volume = reverse = None
+            if previous is not None:
+                volume = bucket[LAST_TOTAL] - previous[LAST_TOTAL]
+                reverse = bucket[LAST_NEGATIVE] - previous[LAST_NEGATIVE]
+            if volume is None or volume < 0:
+                # first bucket on record, or the meter total was reset
+                volume = bucket[LAST_TOTAL] - bucket[FIRST_TOTAL]
+            if reverse is None or reverse < 0:
+                reverse = bucket[LAST_NEGATIVE] - bucket[FIRST_NEGATIVE]
+            yield key, bucket, volume, reverse
+            previous = bucket
+
+    def series(self, imei, period="day", start=None, end=None):
+        """One row per hour / day with data for an IMEI, oldest first."""
+        lo, hi = self._range(period, start, end)
+        with self.lock:
+            by_key = self.buckets[period].get(imei, {})
+            return [
+                {
+                    "period": period_label(period, key),
+                    "volume": round(volume, 3),
+                    "reverse": round(reverse, 3),
+                    "count": bucket[COUNT],
+                    "flow_min": bucket[FLOW_MIN],
+                    "flow_max": bucket[FLOW_MAX],
+                    "flow_avg": round(bucket[FLOW_SUM] / bucket[COUNT], 3)
+                }
+                for key, bucket, volume, reverse in self._rows(by_key, lo, hi)
+            ]
+
+    def site_series(self, imeis, period="day", start=None, end=None):
+        """series() summed over several IMEIs (a site), flow_avg weighted by readings."""
+        lo, hi = self._range(period, start, end)
+        merged = {}
+
+        with self.lock:
+            for imei in imeis:
+                by_key = self.buckets[period].get(imei, {})
+                for key, bucket, volume, reverse in self._rows(by_key, lo, hi):
+                    row = merged.get(key)
+                    if row is None:
+                        merged[key] = row = {
+                            "period": period_label(period, key),
+                            "volume": 0.0,
+                            "reverse": 0.0,
+                            "count": 0,
+                            "flow_min": bucket[FLOW_MIN],
+                            "flow_max": bucket[FLOW_MAX],
+                            "flow_sum": 0.0,
+                            "modems": 0
+                        }
+                    row["volume"] += volume
+                    row["reverse"] += reverse
+                    row["count"] += bucket[COUNT]
+                    row["flow_min"] = min(row["flow_min"], bucket[FLOW_MIN])
+                    row["flow_max"] = max(row["flow_max"], bucket[FLOW_MAX])
+                    row["flow_sum"] += bucket[FLOW_SUM]
+                    row["modems"] += 1
+
+        rows = [merged[key] for key in sorted(merged)]
+        for row in rows:
+            row["volume"] = round(row["volume"], 3)
+            row["reverse"] = round(row["reverse"], 3)
+            row["flow_avg"] = round(row.pop("flow_sum") / row["count"], 3)
+        return rows
+
+    def totals(self, imeis, start=None, end=None):
+        """imei -> {volume, reverse, count} over the days from start to end."""
+        lo, hi = self._range("day", start, end)
+        result = {}
+
+        with self.lock:
+            for imei in imeis:
+                volume = reverse = 0.0
+                count = 0
+                for _, bucket, v, r in self._rows(self.buckets["day"].get(imei, {}), lo, hi):
+                    volume += v
+                    reverse += r
+                    count += bucket[COUNT]
+                result[imei] = {
+                    "volume": round(volume, 3),
+                    "reverse": round(reverse, 3),
+                    "count": count
+                }
+        return result
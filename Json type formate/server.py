@@ -1,19 +1,55 @@
 import socket
 import threading
-import json
+import asyncio
+import logging
 from datetime import datetime
 import os
+import signal
+import sys
+import time
+
+from device_registry import DeviceRegistry
+from jsonl_writer import JsonlWriter
+from log_rotation import LogRotation
+from modem_framing import FrameBuffer, frame_totals, frame_totals_lock
 
 # ================= CONFIG =================
 HOST = "0.0.0.0"
 PORT = 5003
 BUFFER_SIZE = 4096
+SOCKET_TIMEOUT = 300
+LISTEN_BACKLOG = 1024
+
+# "threaded" = one thread per modem, "asyncio" = single event loop for all modems
+SERVER_MODES = ("threaded", "asyncio")
+SERVER_MODE = os.environ.get("MODEM_SERVER_MODE", "threaded")
 
 DATA_FILE = "modem_data.jsonl"
 DEVICE_FILE = "devices.json"
+DEVICE_FLUSH_INTERVAL = 2  # seconds between first_seen/last_seen rewrites
+
+# modem_data.jsonl group commit
+WRITER_MAX_BATCH = 500      # records per write
+WRITER_MAX_LATENCY = 0.2    # seconds a record may wait in the queue
+WRITER_FSYNC = os.environ.get("MODEM_WRITER_FSYNC", "never")  # "never" | "batch" | seconds
+
+FRAME_STATS_INTERVAL = 300  # seconds between framing counter reports
+ACCEPT_POLL = 1.0           # seconds the threaded accept loop waits before checking for a stop
+
+# DEBUG echoes every logged record to the console
+LOG_LEVEL = os.environ.get("MODEM_LOG_LEVEL", "INFO")
 
-file_lock = threading.Lock()
-device_lock = threading.Lock()
+logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+log = logging.getLogger("modem_server")
+
+device_registry = DeviceRegistry(DEVICE_FILE, flush_interval=DEVICE_FLUSH_INTERVAL)
+data_writer = JsonlWriter(
+    DATA_FILE,
+    max_batch=WRITER_MAX_BATCH,
+    max_latency=WRITER_MAX_LATENCY,
+    fsync=WRITER_FSYNC,
+    rotation=LogRotation(DATA_FILE)
+)
 
 # Cache for reconnects (IP → IMEI)
 ip_imei_cache = {}
@@ -22,17 +58,6 @@ print("🐧 NB-IoT Modem TCP Server (Linux)")
 print("🔐 Device verification enabled")
 print("🚀 Ready")
 
-# ================= LOAD DEVICES =================
-def load_devices():
-    if not os.path.exists(DEVICE_FILE):
-        return {}
-    with device_lock, open(DEVICE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def save_devices(devices):
-    with device_lock, open(DEVICE_FILE, "w", encoding="utf-8") as f:
-        json.dump(devices, f, indent=2)
-
 # ================= LOGGER =================
 def log_json(protocol, addr, imei, raw_bytes):
     record = {
@@ -45,11 +70,9 @@ def log_json(protocol, addr, imei, raw_bytes):
         "data_hex": raw_bytes.hex()
     }
 
-    print(record)
+    log.debug(record)
 
-    with file_lock:
-        with open(DATA_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record) + "\n")
+    data_writer.write(record)
 
 # ================= TCP KEEPALIVE =================
 def enable_keepalive(sock):
@@ -69,15 +92,72 @@ def extract_imei(msg):
 
     return None
 
-# ================= TCP HANDLER =================
+# ================= PACKET PROCESSING =================
+def new_session():
+    return {"imei": None, "verified": False, "frames": FrameBuffer()}
+
+def close_session(addr, session):
+    stats = session["frames"].close()
+    if stats["split_frames"] or stats["merged_reads"] or stats["dropped_partial"]:
+        print(
+            f"🧩 Framing {addr}: {stats['frames']} frames | "
+            f"split {stats['split_frames']} | merged reads {stats['merged_reads']} | "
+            f"dropped partial {stats['dropped_partial']}"
+        )
+
+def process_chunk(addr, data, session):
+    # one record per complete NB...END frame, loose bytes only carry IMEI hellos
+    for is_frame, payload in session["frames"].feed(data):
+        process_message(addr, payload, session, log_data=is_frame)
+
+def process_message(addr, data, session, log_data=True):
+    msg = data.decode(errors="ignore")
+    detected_imei = extract_imei(msg)
+
+    now = datetime.now().isoformat()
+
+    # ----- IMEI VERIFICATION -----
+    if detected_imei:
+        device = device_registry.get(detected_imei)
+
+        if device and device.get("activated") is True:
+            session["imei"] = detected_imei
+            session["verified"] = True
+            ip_imei_cache[addr[0]] = detected_imei
+
+            device_registry.touch(detected_imei, now)
+
+            print(f"✅ IMEI verified: {detected_imei}")
+        else:
+            print(f"⛔ IMEI not registered / not activated: {detected_imei}")
+            return  # ❌ DO NOT LOG DATA
+
+    elif addr[0] in ip_imei_cache:
+        cached = ip_imei_cache[addr[0]]
+        device = device_registry.get(cached)
+
+        if device and device.get("activated"):
+            session["imei"] = cached
+            session["verified"] = True
+            device_registry.touch(cached, now)
+
+    if not log_data:
+        return
+
+    # ----- LOG DATA ONLY IF VERIFIED -----
+    if session["verified"]:
+        log_json("TCP", addr, session["imei"], data)
+    else:
+        print(f"🚫 Data ignored (IMEI not verified) from {addr}")
+
+# ================= TCP HANDLER (THREADED) =================
 def handle_tcp(conn, addr):
     print(f"🔗 TCP connected: {addr}")
 
     enable_keepalive(conn)
-    conn.settimeout(300)
+    conn.settimeout(SOCKET_TIMEOUT)
 
-    imei = None
-    imei_verified = False
+    session = new_session()
 
     try:
         while True:
@@ -87,48 +167,7 @@ def handle_tcp(conn, addr):
                     print(f"🔌 Modem disconnected: {addr}")
                     break
 
-                msg = data.decode(errors="ignore")
-                detected_imei = extract_imei(msg)
-
-                devices = load_devices()
-                now = datetime.now().isoformat()
-
-                # ----- IMEI VERIFICATION -----
-                if detected_imei:
-                    device = devices.get(detected_imei)
-
-                    if device and device.get("activated") is True:
-                        imei = detected_imei
-                        imei_verified = True
-                        ip_imei_cache[addr[0]] = imei
-
-                        if not device.get("first_seen"):
-                            device["first_seen"] = now
-                        device["last_seen"] = now
-                        devices[imei] = device
-                        save_devices(devices)
-
-                        print(f"✅ IMEI verified: {imei}")
-                    else:
-                        print(f"⛔ IMEI not registered / not activated: {detected_imei}")
-                        continue  # ❌ DO NOT LOG DATA
-
-                elif addr[0] in ip_imei_cache:
-                    cached = ip_imei_cache[addr[0]]
-                    device = devices.get(cached)
-
-                    if device and device.get("activated"):
-                        imei = cached
-                        imei_verified = True
-                        device["last_seen"] = now
-                        devices[imei] = device
-                        save_devices(devices)
-
-                # ----- LOG DATA ONLY IF VERIFIED -----
-                if imei_verified:
-                    log_json("TCP", addr, imei, data)
-                else:
-                    print(f"🚫 Data ignored (IMEI not verified) from {addr}")
+                process_chunk(addr, data, session)
 
             except socket.timeout:
                 continue
@@ -137,26 +176,175 @@ def handle_tcp(conn, addr):
         print(f"⚠ TCP error {addr}: {e}")
 
     finally:
+        close_session(addr, session)
         conn.close()
         print(f"❌ TCP session closed: {addr}")
 
-# ================= TCP SERVER =================
+# ================= TCP SERVER (THREADED) =================
 def tcp_server():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.bind((HOST, PORT))
-    sock.listen(200)
+    sock.listen(LISTEN_BACKLOG)
 
     print(f"🚀 TCP listening on {HOST}:{PORT}")
 
+    sock.settimeout(ACCEPT_POLL)
+    try:
+        while not stop_requested.is_set():
+            try:
+                conn, addr = sock.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(
+                target=handle_tcp,
+                args=(conn, addr),
+                daemon=True
+            ).start()
+    finally:
+        sock.close()
+
+# ================= TCP HANDLER (ASYNCIO) =================
+async_sessions = {}  # writer -> handler task, closed on shutdown
+
+async def handle_tcp_async(reader, writer):
+    addr = writer.get_extra_info("peername")[:2]
+    print(f"🔗 TCP connected: {addr}")
+    async_sessions[writer] = asyncio.current_task()
+
+    enable_keepalive(writer.get_extra_info("socket"))
+
+    session = new_session()
+    loop = asyncio.get_running_loop()
+
+    # No read timeout here: the threaded path only loops on socket.timeout,
+    # dead peers are detected by TCP keepalive in both modes.
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                print(f"🔌 Modem disconnected: {addr}")
+                break
+
+            # registry lookups, the record write and the console output run in
+            # the default executor; the next read waits for it, so a session's
+            # frames stay in order and a slow modem cannot queue up unbounded
+            await loop.run_in_executor(None, process_chunk, addr, data, session)
+
+    except Exception as e:
+        print(f"⚠ TCP error {addr}: {e}")
+
+    finally:
+        async_sessions.pop(writer, None)
+        close_session(addr, session)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        print(f"❌ TCP session closed: {addr}")
+
+# ================= TCP SERVER (ASYNCIO) =================
+def raise_fd_limit():
+    # every idle modem holds one file descriptor
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    print(f"📂 Open file limit: {soft}")
+
+async def async_tcp_server():
+    server = await asyncio.start_server(
+        handle_tcp_async,
+        HOST,
+        PORT,
+        backlog=LISTEN_BACKLOG,
+        reuse_address=True
+    )
+
+    # the signal only wakes the loop, main flushes once asyncio.run() has returned
+    # (which also waits for chunks still being processed in the default executor)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for name in ("SIGTERM", "SIGBREAK"):
+        signum = getattr(signal, name, None)
+        if signum is None:
+            continue
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            # no add_signal_handler on Windows event loops
+            signal.signal(signum, lambda s, f: loop.call_soon_threadsafe(stop.set))
+    if stop_requested.is_set():
+        stop.set()
+
+    print(f"🚀 TCP listening on {HOST}:{PORT} (asyncio)")
+
+    await stop.wait()
+    server.close()
+
+    # closing a session's socket ends its read loop, so each one finishes its own cleanup
+    tasks = list(async_sessions.values())
+    for writer in list(async_sessions):
+        writer.close()
+    if tasks:
+        await asyncio.wait(tasks, timeout=5)
+
+# ================= FRAMING STATS =================
+def frame_stats_loop():
+    last = None
     while True:
-        conn, addr = sock.accept()
-        threading.Thread(
-            target=handle_tcp,
-            args=(conn, addr),
-            daemon=True
-        ).start()
+        time.sleep(FRAME_STATS_INTERVAL)
+        with frame_totals_lock:
+            totals = dict(frame_totals)
+        if totals != last:
+            print("🧩 Framing totals: " + " | ".join(f"{k} {v}" for k, v in totals.items()))
+            last = totals
+
+# ================= SHUTDOWN =================
+# run_all.py stops services with terminate() (SIGTERM, CTRL_BREAK on Windows),
+# which skips atexit. The handler only asks the server to stop: it runs on the
+# main thread, which may be inside the registry or writer locks right then.
+# main writes the queued records and last_seen updates once the server returned.
+stop_requested = threading.Event()
+
+def request_stop(signum, frame):
+    stop_requested.set()
+
+def flush_on_exit():
+    print("🛑 Stopping, flushing queued records...")
+    data_writer.close()
+    try:
+        device_registry.flush()
+    except OSError as e:
+        print(f"⚠ Device registry flush failed: {e}")
 
 # ================= MAIN =================
 if __name__ == "__main__":
-    tcp_server()
\ No newline at end of file
+    mode = sys.argv[1] if len(sys.argv) > 1 else SERVER_MODE
+    if mode not in SERVER_MODES:
+        print(f"❌ Unknown server mode {mode!r}, use one of: {', '.join(SERVER_MODES)}")
+        sys.exit(1)
+
+    device_registry.start()
+    data_writer.start()
+    signal.signal(signal.SIGTERM, request_stop)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, request_stop)
+    threading.Thread(target=frame_stats_loop, daemon=True).start()
+
+    try:
+        if mode == "asyncio":
+            raise_fd_limit()
+            asyncio.run(async_tcp_server())
+        elif mode == "threaded":
+            tcp_server()
+    finally:
+        flush_on_exit()
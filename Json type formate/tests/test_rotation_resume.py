@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_watch import TailReader
+from log_rotation import LogRotation, load_segments, manifest_path
+from outbound_queue import OutboundQueue, get_last_position
+from reading_index import ReadingIndex
+
+# ================= HELPERS =================
+def append(path, first, count, imei="A"):
+    with open(path, "ab") as f:
+        for n in range(first, first + count):
+            record = {
+                "timestamp": f"2026-01-01 00:{n // 60:02d}:{n % 60:02d}",
+                "imei": imei,
+                "decoded_measurements": {"n": n}
+            }
+            f.write(json.dumps(record).encode() + b"\n")
+
+def numbers(records):
+    return [record["decoded_measurements"]["n"] for record in records]
+
+def read_all(reader):
+    found = []
+    while True:
+        lines = reader.read_lines(7)
+        if not lines:
+            return found
+        found += numbers(json.loads(line) for _, line in lines)
+
+def rotate(rotation):
+    rotation.rotate()
+    rotation.maintain()   # waits for the background pass, then gzips what is left
+
+def rotated_log(tmp_path):
+    # 0..7 read before the checkpoint, 8..19 and 20..29 end up in gzipped segments
+    path = str(tmp_path / "decord_result.jsonl")
+    rotation = LogRotation(path, max_bytes=0, when="never", compress=True)
+    append(path, 0, 20)
+    reader = TailReader(path)
+    assert len(reader.read_lines(8)) == 8
+    rotate(rotation)
+    append(path, 20, 10)
+    rotate(rotation)
+    append(path, 30, 5)
+    return path, rotation, reader
+
+def entry(offset, length, imei, inode=1):
+    return {"offset": offset, "next_offset": offset + length, "inode": inode, "imei": imei}
+
+# ================= TAIL READER =================
+def test_tail_reader_resumes_inside_gzipped_segment(tmp_path):
+    path, rotation, reader = rotated_log(tmp_path)
+    assert [e["compressed"] for e in load_segments(path)] == [True, True]
+
+    resumed = TailReader(path, reader.offset, reader.inode)
+    assert read_all(resumed) == list(range(8, 35))
+
+def test_tail_reader_follows_rotation_it_was_reading(tmp_path):
+    path, rotation, reader = rotated_log(tmp_path)
+    assert read_all(reader) == list(range(8, 35))
+
+def test_tail_reader_resumes_at_oldest_segment_after_expiry(tmp_path):
+    path, rotation, reader = rotated_log(tmp_path)
+
+    # the checkpoint's segment is past retention, the one after it is not
+    with open(manifest_path(path), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["segments"][0]["closed"] = "2000-01-01 00:00:00"
+    with open(manifest_path(path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    rotation.retain_days = 1
+    rotation.maintain()
+    assert len(load_segments(path)) == 1
+
+    resumed = TailReader(path, reader.offset, reader.inode)
+    assert read_all(resumed) == list(range(20, 35))
+
+# ================= OUTBOUND QUEUE =================
+def test_checkpoint_stays_at_oldest_unacked_record(tmp_path):
+    position_file = str(tmp_path / "last_sent_position.txt")
+    outbound = OutboundQueue(position_file, 0, 1, interval=0)
+    records = [entry(0, 10, "A"), entry(10, 10, "B"), entry(20, 10, "A"), entry(30, 10, "B")]
+    for record in records:
+        outbound.track(record)
+
+    outbound.done(records[1:])
+    outbound.save_checkpoint(force=True)
+    offset, inode, replay = get_last_position(position_file)
+    assert (offset, inode) == (0, 1)
+    assert replay == {"read": (40, 1), "inodes": [1], "pending": {"A": (0, 1)}}
+
+    outbound.done(records[:1])
+    outbound.save_checkpoint(force=True)
+    assert get_last_position(position_file) == (40, 1, None)
+
+def test_restart_publishes_again_only_for_imeis_still_waiting(tmp_path):
+    position_file = str(tmp_path / "last_sent_position.txt")
+    outbound = OutboundQueue(position_file, 0, 1, interval=0)
+    records = [entry(0, 10, "A"), entry(10, 10, "B"), entry(20, 10, "A"), entry(30, 10, "B")]
+    for record in records:
+        outbound.track(record)
+    outbound.done(records[1:])
+    outbound.save_checkpoint(force=True)
+
+    offset, inode, replay = get_last_position(position_file)
+    restarted = OutboundQueue(position_file, offset, inode, replay, interval=0)
+    again = records + [entry(40, 10, "B")]
+    assert [restarted.replayed(dict(record)) for record in again] == [False, True, False, True, False]
+    assert restarted.replay is None
+
+# ================= READING INDEX =================
+def test_reading_index_covers_rotated_segments(tmp_path):
+    path = str(tmp_path / "decord_result.jsonl")
+    rotation = LogRotation(path, max_bytes=0, when="never", compress=True)
+    append(path, 0, 30)
+    index = ReadingIndex(path)
+    _, _, _, since = index.readings("A", limit=1)
+
+    rotate(rotation)
+    append(path, 30, 20)
+
+    records, _, has_more, _ = index.readings("A", limit=1000)
+    assert numbers(records) == list(range(50)) and not has_more
+
+    pages = []
+    cursor = None
+    while True:
+        records, cursor, has_more, _ = index.readings("A", start="2026-01-01", cursor=cursor, limit=9)
+        pages += numbers(records)
+        if not has_more:
+            break
+    assert pages == list(range(50))
+
+    scan = index.scan("A", start="2026-01-01 00:00:20", end="2026-01-01 00:00:39")
+    assert scan["count"] == 20 and numbers(scan["records"]) == list(range(20, 40))
+
+    # a since taken before the rotation still resumes where it was
+    records, _, _ = index.readings_since("A", since, limit=1000)
+    assert numbers(records) == list(range(30, 50))